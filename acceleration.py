@@ -0,0 +1,43 @@
+# acceleration.py
+# Pointer acceleration for mouse mode. The speed -> gain curve is turned into a lookup table once,
+# so each update costs one table read instead of evaluating the curve.
+import math
+
+class AccelerationCurve:
+
+    def __init__(self, points=((0.0, 0.5), (1.0, 1.0), (4.0, 2.5)), max_speed=8.0, steps=64, x_gain=1.0, y_gain=1.0):
+        """
+        points: (speed, gain) pairs with increasing speed. Speed is the pen movement in mm per update,
+                the gain multiplies the profile sensitivity. Between points the gain is linear, past the
+                last point it stays flat.
+        max_speed: Speed (mm per update) covered by the table, anything faster uses the last entry.
+        steps: Number of table entries the speed is quantized into.
+        x_gain, y_gain: Extra per-axis gain, e.g. to match the aspect ratio of the screen.
+        """
+        self.x_gain = x_gain
+        self.y_gain = y_gain
+        self.last_index = steps - 1
+        self.index_scale = steps / max_speed
+
+        # Precompute the gain at the middle of each quantized speed step
+        self.table = [0.0] * steps
+        for i in range(steps):
+            self.table[i] = self._interpolate(points, (i + 0.5) / self.index_scale)
+
+    @staticmethod
+    def _interpolate(points, speed):
+        if speed <= points[0][0]:
+            return points[0][1]
+        for i in range(1, len(points)):
+            speed_1, gain_1 = points[i]
+            if speed <= speed_1:
+                speed_0, gain_0 = points[i - 1]
+                return gain_0 + (gain_1 - gain_0) * (speed - speed_0) / (speed_1 - speed_0)
+        return points[-1][1]
+
+    def gain(self, dx, dy):
+        # Gain for a movement of (dx, dy) mm since the last update
+        index = int(math.sqrt(dx * dx + dy * dy) * self.index_scale)
+        if index > self.last_index:
+            index = self.last_index
+        return self.table[index]
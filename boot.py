@@ -1,4 +1,6 @@
+import os
 import usb_hid
+import usb_cdc
 import supervisor
 import usb.core
 
@@ -55,6 +57,23 @@ CUSTOM_HID_DESCRIPTOR = bytes((
     0x95, 0x03,         # Report Count 3
     0x81, 0x02,         # Input (Data,Var,Abs)
 
+    # Host commands (command byte + argument byte), e.g. switching profiles. See CustomHid.poll_host_commands()
+    0x09, 0x50,         # Usage (Vendor-defined command)
+    0x15, 0x00,         # Logical Minimum (0)
+    0x26, 0xFF, 0x00,   # Logical Maximum (255)
+    0x75, 0x08,         # Report Size (8)
+    0x95, 0x02,         # Report Count (2)
+    0x91, 0x02,         # Output (Data,Var,Abs)
+
+    # Latency echo: the stamp of an echo command and the device's timestamps. See CustomHid.send_echo_report()
+    0x85, 0x06,         # Report ID (6)
+    0x09, 0x60,         # Usage (Vendor-defined echo)
+    0x15, 0x00,         # Logical Minimum (0)
+    0x26, 0xFF, 0x00,   # Logical Maximum (255)
+    0x75, 0x08,         # Report Size (8)
+    0x95, 0x0D,         # Report Count (13)
+    0x81, 0x02,         # Input (Data,Var,Abs)
+
     0xC0                # End Collection
 ))
 
@@ -62,9 +81,190 @@ custom_hid = usb_hid.Device(
     report_descriptor=CUSTOM_HID_DESCRIPTOR,
     usage_page=0xFF00,    # Vendor-defined page
     usage=0x01,
-    in_report_lengths=(16,),   # X, Y, Wheel, Buttons -> 4 bytes
+    in_report_lengths=(16, 13),   # X, Y, Wheel, Buttons -> 4 bytes; the echo report
+    out_report_lengths=(2, 0),    # Command, Argument; nothing for the echo report
+    report_ids=(4, 6), 
+)
+
+# Absolute pen digitizer, used by the pen profile (see digitizer.py)
+DIGITIZER_DESCRIPTOR = bytes((
+    0x05, 0x0D,         # Usage Page (Digitizer)
+    0x09, 0x02,         # Usage (Pen)
+    0xA1, 0x01,         # Collection (Application)
+    0x85, 0x05,         #   Report ID (5)
+    0x09, 0x20,         #   Usage (Stylus)
+    0xA1, 0x00,         #   Collection (Physical)
+
+    # Tip, barrel and in-range flags
+    0x09, 0x42,         #     Usage (Tip Switch)
+    0x09, 0x44,         #     Usage (Barrel Switch)
+    0x09, 0x32,         #     Usage (In Range)
+    0x15, 0x00,         #     Logical Minimum (0)
+    0x25, 0x01,         #     Logical Maximum (1)
+    0x75, 0x01,         #     Report Size (1)
+    0x95, 0x03,         #     Report Count (3)
+    0x81, 0x02,         #     Input (Data,Var,Abs)
+    0x95, 0x05,         #     Report Count (5) - padding
+    0x81, 0x03,         #     Input (Const,Var,Abs)
+
+    # Absolute X and Y
+    0x05, 0x01,         #     Usage Page (Generic Desktop)
+    0x09, 0x30,         #     Usage (X)
+    0x09, 0x31,         #     Usage (Y)
+    0x15, 0x00,         #     Logical Minimum (0)
+    0x26, 0xFF, 0x7F,   #     Logical Maximum (32767)
+    0x75, 0x10,         #     Report Size (16)
+    0x95, 0x02,         #     Report Count (2)
+    0x81, 0x02,         #     Input (Data,Var,Abs)
+
+    # Pressure from the depth below the drawing surface
+    0x05, 0x0D,         #     Usage Page (Digitizer)
+    0x09, 0x30,         #     Usage (Tip Pressure)
+    0x15, 0x00,         #     Logical Minimum (0)
+    0x26, 0xFF, 0x03,   #     Logical Maximum (1023)
+    0x75, 0x10,         #     Report Size (16)
+    0x95, 0x01,         #     Report Count (1)
+    0x81, 0x02,         #     Input (Data,Var,Abs)
+
+    0xC0,               #   End Collection
+    0xC0                # End Collection
+))
+
+digitizer = usb_hid.Device(
+    report_descriptor=DIGITIZER_DESCRIPTOR,
+    usage_page=0x0D,    # Digitizer
+    usage=0x02,         # Pen
+    in_report_lengths=(7,),    # Flags, X, Y, Pressure
     out_report_lengths=(0,),
-    report_ids=(4,), 
+    report_ids=(5,),
+)
+
+# 16-bit relative mouse, enabled instead of the standard mouse with MOBI3_HIRES_MOUSE = 1 in settings.toml (see hires_mouse.py)
+HIRES_MOUSE_DESCRIPTOR = bytes((
+    0x05, 0x01,         # Usage Page (Generic Desktop)
+    0x09, 0x02,         # Usage (Mouse)
+    0xA1, 0x01,         # Collection (Application)
+    0x85, 0x02,         #   Report ID (2)
+    0x09, 0x01,         #   Usage (Pointer)
+    0xA1, 0x00,         #   Collection (Physical)
+
+    # 5 buttons
+    0x05, 0x09,         #     Usage Page (Buttons)
+    0x19, 0x01,         #     Usage Minimum (Button 1)
+    0x29, 0x05,         #     Usage Maximum (Button 5)
+    0x15, 0x00,         #     Logical Minimum (0)
+    0x25, 0x01,         #     Logical Maximum (1)
+    0x75, 0x01,         #     Report Size (1)
+    0x95, 0x05,         #     Report Count (5)
+    0x81, 0x02,         #     Input (Data,Var,Abs)
+    0x95, 0x03,         #     Report Count (3) - padding
+    0x81, 0x03,         #     Input (Const,Var,Abs)
+
+    # X and Y
+    0x05, 0x01,         #     Usage Page (Generic Desktop)
+    0x09, 0x30,         #     Usage (X)
+    0x09, 0x31,         #     Usage (Y)
+    0x16, 0x01, 0x80,   #     Logical Minimum (-32767)
+    0x26, 0xFF, 0x7F,   #     Logical Maximum (32767)
+    0x75, 0x10,         #     Report Size (16)
+    0x95, 0x02,         #     Report Count (2)
+    0x81, 0x06,         #     Input (Data,Var,Rel)
+
+    # Wheel. The Resolution Multiplier lets the host switch it to 1/120 of a detent per unit (see scroll.py)
+    0xA1, 0x02,         #     Collection (Logical)
+    0x09, 0x48,         #       Usage (Resolution Multiplier)
+    0x15, 0x00,         #       Logical Minimum (0)
+    0x25, 0x01,         #       Logical Maximum (1)
+    0x35, 0x01,         #       Physical Minimum (1)
+    0x45, 0x78,         #       Physical Maximum (120)
+    0x75, 0x02,         #       Report Size (2)
+    0x95, 0x01,         #       Report Count (1)
+    0xB1, 0x02,         #       Feature (Data,Var,Abs)
+    0x35, 0x00,         #       Physical Minimum (0)
+    0x45, 0x00,         #       Physical Maximum (0)
+    0x09, 0x38,         #       Usage (Wheel)
+    0x16, 0x01, 0x80,   #       Logical Minimum (-32767)
+    0x26, 0xFF, 0x7F,   #       Logical Maximum (32767)
+    0x75, 0x10,         #       Report Size (16)
+    0x81, 0x06,         #       Input (Data,Var,Rel)
+    0xC0,               #     End Collection
+
+    # Horizontal pan, with its own Resolution Multiplier
+    0xA1, 0x02,         #     Collection (Logical)
+    0x09, 0x48,         #       Usage (Resolution Multiplier)
+    0x15, 0x00,         #       Logical Minimum (0)
+    0x25, 0x01,         #       Logical Maximum (1)
+    0x35, 0x01,         #       Physical Minimum (1)
+    0x45, 0x78,         #       Physical Maximum (120)
+    0x75, 0x02,         #       Report Size (2)
+    0xB1, 0x02,         #       Feature (Data,Var,Abs)
+    0x75, 0x04,         #       Report Size (4) - padding to a whole byte
+    0xB1, 0x03,         #       Feature (Const,Var,Abs)
+    0x35, 0x00,         #       Physical Minimum (0)
+    0x45, 0x00,         #       Physical Maximum (0)
+    0x05, 0x0C,         #       Usage Page (Consumer)
+    0x0A, 0x38, 0x02,   #       Usage (AC Pan)
+    0x16, 0x01, 0x80,   #       Logical Minimum (-32767)
+    0x26, 0xFF, 0x7F,   #       Logical Maximum (32767)
+    0x75, 0x10,         #       Report Size (16)
+    0x81, 0x06,         #       Input (Data,Var,Rel)
+    0xC0,               #     End Collection
+
+    0xC0,               #   End Collection
+    0xC0                # End Collection
+))
+
+hires_mouse = usb_hid.Device(
+    report_descriptor=HIRES_MOUSE_DESCRIPTOR,
+    usage_page=0x01,    # Generic Desktop
+    usage=0x02,         # Mouse
+    in_report_lengths=(9,),    # Buttons, X, Y, Wheel, Pan
+    out_report_lengths=(1,),   # The Resolution Multiplier feature report set by the host
+    report_ids=(2,),
+)
+
+# N-key-rollover keyboard, enabled instead of the standard keyboard with MOBI3_NKRO_KEYBOARD = 1 in settings.toml (see nkro_keyboard.py)
+NKRO_KEYBOARD_DESCRIPTOR = bytes((
+    0x05, 0x01,         # Usage Page (Generic Desktop)
+    0x09, 0x06,         # Usage (Keyboard)
+    0xA1, 0x01,         # Collection (Application)
+    0x85, 0x01,         #   Report ID (1)
+
+    # Modifiers
+    0x05, 0x07,         #   Usage Page (Keyboard)
+    0x19, 0xE0,         #   Usage Minimum (Left Control)
+    0x29, 0xE7,         #   Usage Maximum (Right GUI)
+    0x15, 0x00,         #   Logical Minimum (0)
+    0x25, 0x01,         #   Logical Maximum (1)
+    0x75, 0x01,         #   Report Size (1)
+    0x95, 0x08,         #   Report Count (8)
+    0x81, 0x02,         #   Input (Data,Var,Abs)
+
+    # One bit per key
+    0x19, 0x00,         #   Usage Minimum (0)
+    0x29, 0x77,         #   Usage Maximum (0x77)
+    0x95, 0x78,         #   Report Count (120)
+    0x81, 0x02,         #   Input (Data,Var,Abs)
+
+    # LEDs
+    0x05, 0x08,         #   Usage Page (LEDs)
+    0x19, 0x01,         #   Usage Minimum (Num Lock)
+    0x29, 0x05,         #   Usage Maximum (Kana)
+    0x95, 0x05,         #   Report Count (5)
+    0x91, 0x02,         #   Output (Data,Var,Abs)
+    0x95, 0x03,         #   Report Count (3) - padding
+    0x91, 0x03,         #   Output (Const,Var,Abs)
+
+    0xC0                # End Collection
+))
+
+nkro_keyboard = usb_hid.Device(
+    report_descriptor=NKRO_KEYBOARD_DESCRIPTOR,
+    usage_page=0x01,    # Generic Desktop
+    usage=0x06,         # Keyboard
+    in_report_lengths=(16,),   # Modifiers, 120 key bits
+    out_report_lengths=(1,),   # LEDs
+    report_ids=(1,),
 )
 
 # supervisor.set_usb_identification(
@@ -76,12 +276,17 @@ custom_hid = usb_hid.Device(
 
 # Note to self: if enabling the other devices, make sure to create its respective HID object in code.py or the reports will fail
 usb_hid.enable(
-    (#  usb_hid.Device.KEYBOARD,
-     usb_hid.Device.MOUSE,
+    (nkro_keyboard if os.getenv("MOBI3_NKRO_KEYBOARD", 0) else usb_hid.Device.KEYBOARD, # Button macros, see macros.py
+     hires_mouse if os.getenv("MOBI3_HIRES_MOUSE", 0) else usb_hid.Device.MOUSE,
     #  usb_hid.Device.CONSUMER_CONTROL,
-     custom_hid,),     
+     custom_hid,
+     digitizer,),     
 )
 
+# The data channel carries the binary sample stream (see stream.py), the console stays free for the REPL and prints
+if os.getenv("MOBI3_SAMPLE_STREAM", 0):
+    usb_cdc.enable(console=True, data=True)
+
 # # Gamepad report descriptor from adafruit for reference on how to setup HID devices (https://learn.adafruit.com/custom-hid-devices-in-circuitpython/report-descriptors)
 # GAMEPAD_REPORT_DESCRIPTOR = bytes((
 #     0x05, 0x01,  # Usage Page (Generic Desktop Ctrls)
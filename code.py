@@ -1,31 +1,32 @@
 # code.py
 # Note: Units of measurement are in millimeters, units of rotation are in radians
-import usb_hid
 import time
+boot_start = time.monotonic_ns()
+import os
+import supervisor
+import usb_hid
 import board
 import busio
 import bitbangio
-import math
 import digitalio
-from adafruit_hid.mouse import Mouse
-from moving_average import MovingAverage
-from adafruit_as5600 import AS5600
+from sensor_health import SensorMonitor
 
 print("Hello World!")
 
-# Setup HID devices
-custom = usb_hid.devices[-1] # The custom HID device is the last in the list from usb_hid.enable() in boot.py
-mouse = Mouse(usb_hid.devices)
+# Startup timing, printed once the first report has been sent. Time to first report is what we want to drive down.
+boot_marks = []
+def mark(name):
+    boot_marks.append((name, time.monotonic_ns()))
 
 # Setup 3 I2C busses to handle the three as5600 sensors. They must be on seperate busses as they all use the same slave address.
 # i2c1 corresponds to rotation_sensor_3 (the turntable one) and not arm1's rotation sensor. Sorry!
-i2c1 = busio.I2C(scl=board.GP1, sda=board.GP0, frequency=100000)
-i2c2 = busio.I2C(scl=board.GP7, sda=board.GP6, frequency=100000) 
-i2c3 = bitbangio.I2C(scl=board.GP9, sda=board.GP8, frequency=100000) # The pi pico only has 2 hardware i2c busses, so a third one is bit-banged onto GPIO 8 and 9
-
-rotation1_sensor = AS5600(i2c2) # Arm 1 rotation sensor
-rotation2_sensor = AS5600(i2c3) # Arm 2 rotation sensor
-rotation3_sensor = AS5600(i2c1) # Turntable rotation sensor
+# Each SensorMonitor creates its bus (and recreates it to recover from errors), see sensor_health.py
+rotation1_sensor = SensorMonitor("arm1", lambda: busio.I2C(scl=board.GP7, sda=board.GP6, frequency=100000), # i2c2
+                                 board.GP7, board.GP6)
+rotation2_sensor = SensorMonitor("arm2", lambda: bitbangio.I2C(scl=board.GP9, sda=board.GP8, frequency=100000), # i2c3
+                                 board.GP9, board.GP8) # The pi pico only has 2 hardware i2c busses, so a third one is bit-banged onto GPIO 8 and 9
+rotation3_sensor = SensorMonitor("turntable", lambda: busio.I2C(scl=board.GP1, sda=board.GP0, frequency=100000), # i2c1
+                                 board.GP1, board.GP0)
 
 def registerButton(button_pin):
     button = digitalio.DigitalInOut(button_pin)
@@ -36,17 +37,90 @@ def registerButton(button_pin):
 button1 = registerButton(board.GP11)
 button2 = registerButton(board.GP12)
 button3 = registerButton(board.GP13)
+mark("sensors")
 
 ##########
 ## Loop
 ##########
 from custom_hid import CustomHid
-device = CustomHid(mouse, custom, 
+from oversampling import Oversampler
+from power import PowerManager
+import profiles
+# The profiles the chord and the host can switch to, all of them by default. The digitizer and the scroll mapper
+# are only set up below if their profile is one of them.
+enabled_profiles = profiles.enabled_profiles(os.getenv("MOBI3_PROFILES", ""))
+power = PowerManager(idle_timeout=5, sleep_timeout=60, idle_period_ms=20, sleep_period_ms=100,
+                     sleep_frequency=None) # e.g. 48000000 to also slow the CPU down while asleep, see power.py
+# The HID devices are attached once USB is up, see below
+device = CustomHid(None, None, 
                    rotation1_sensor, rotation2_sensor, rotation3_sensor,
-                   button1, button2, button3)
+                   button1, button2, button3,
+                   profile=profiles.CUSTOM_HID if profiles.CUSTOM_HID in enabled_profiles else enabled_profiles[0],
+                   profiles=enabled_profiles, # Hold buttons 2 and 3 together to switch to the next one
+                   estimator=None, # e.g. KalmanEstimator(lead_time=0.01) from kalman.py to predict 10 ms ahead
+                   oversampler=Oversampler((rotation1_sensor, rotation2_sensor, rotation3_sensor), period_us=8000), # Median of several reads per update, see oversampling.py
+                   power=power,
+                   recorder=None) # e.g. Recorder(open("/capture.bin", "wb")) from recorder.py, replay with host/replay.py
 
-device.update()
+# Calibrate first, then fill the filters with calibrated samples while USB enumerates
 device.load_calibrations()
+sensor_filter = os.getenv("MOBI3_SENSOR_FILTER", "")
+if sensor_filter: # Let the sensors apply the offsets and the smoothing, see sensor_config.py
+    from sensor_config import FILTERS, DEFAULT_FILTER
+    if sensor_filter not in FILTERS: # A typo mustn't keep the pen from starting
+        print("Unknown MOBI3_SENSOR_FILTER", repr(sensor_filter), "using", repr(DEFAULT_FILTER))
+    device.apply_sensor_config(FILTERS.get(sensor_filter, FILTERS[DEFAULT_FILTER]))
+mark("calibrations")
+for _ in range(profiles.PROFILES[device.profile].smoothing):
+    device.prime()
+while not supervisor.runtime.usb_connected:
+    device.prime()
+mark("usb")
+
+# Setup HID devices. USB is connected, so find_device() returns straight away.
+# Only the HID classes for the devices enabled in boot.py and the profiles enabled above are imported.
+from adafruit_hid import find_device
+custom = find_device(usb_hid.devices, usage_page=0xFF00, usage=0x01) # The custom HID device from boot.py
+if os.getenv("MOBI3_HIRES_MOUSE", 0): # Must match the mouse enabled in boot.py
+    from hires_mouse import HiResMouse
+    mouse = HiResMouse(usb_hid.devices)
+else:
+    from adafruit_hid.mouse import Mouse
+    mouse = Mouse(usb_hid.devices)
+digitizer = None
+if profiles.PEN in enabled_profiles:
+    from digitizer import Digitizer
+    digitizer = Digitizer(usb_hid.devices, workspace=(-150, 40, 150, 210)) # Workspace in mm on the drawing plane, see digitizer.py
+
+# Keyboard macros for the buttons, see macros.py. They play when the buttons are released. Bound buttons no longer click. For example (with Keycode from adafruit_hid.keycode):
+# MACROS = {CustomHid.BUTTON_1: (Keycode.CONTROL, Keycode.Z), CustomHid.BUTTON_1 | CustomHid.BUTTON_2: "Hello!"}
+MACROS = {}
+macros = None
+if MACROS:
+    from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
+    from macros import MacroEngine
+    macros = MacroEngine(usb_hid.devices, KeyboardLayoutUS(None), MACROS, # The layout is only used to compile the macros
+                         nkro=bool(os.getenv("MOBI3_NKRO_KEYBOARD", 0))) # Must match the keyboard enabled in boot.py
+scroll = None
+if profiles.SCROLL in enabled_profiles:
+    from scroll import ScrollMapper
+    scroll = ScrollMapper(mouse, source=ScrollMapper.Z, wheel_gain=0.5, pan_gain=0.2) # For the scroll profile, see scroll.py
+stream = None
+if os.getenv("MOBI3_SAMPLE_STREAM", 0): # Must match boot.py, which enables the usb_cdc data channel
+    import usb_cdc
+    from stream import SampleStream
+    stream = SampleStream(usb_cdc.data) # Every sample over USB serial, read it with host/stream_reader.py
+device.set_outputs(mouse, custom, digitizer, macros, scroll, stream)
+device.prime() # Don't report the movement made while the HID objects were being set up
+mark("hid")
+
+device.update()
+mark("first report")
+last_mark = boot_start
+for name, mark_time in boot_marks:
+    print("Boot:", name, (mark_time - last_mark) // 1000000, "ms")
+    last_mark = mark_time
+print("Time to first report:", (last_mark - boot_start) // 1000000, "ms, since power up:", time.monotonic(), "s")
 
 # last_time = time.monotonic()
 
@@ -60,4 +134,5 @@ while True:
     #     print(f"{hz:.2f} Hz")
     
     device.update()
+    power.wait() # Slows the loop down while the pen is parked
     # time.sleep(0.05)
@@ -1,174 +1,380 @@
-from moving_average import MovingAverage
 import math
 import time
 import struct
-from adafruit_hid.mouse import Mouse
+from array import array
 import microcontroller
-from kinematics import ArmKinematics
+from kinematics import KinematicChain
+from profiles import PROFILES
+from sinks import Sink, bind_sinks
+from drawing_plane import DrawingPlane
+from pipeline import (Sample, Pipeline, SensorSource, MovingAverageFilter, ScaleFilter, KinematicsStage,
+                      EstimatorStage, PlaneStage, Accumulator)
 
 class CustomHid:
 
-    SENSITIVITY = 10 
-    MOUSE_SMOOTHING = 3 # The last N position captures to average out for a smoother result
     THRESHOLD = 2 # The minimum amount of movement required for movement to be reported (unused)
-    
-    ARM1_LENGTH = 170 # The length of arm 1 (the shorter one) in mm
-    ARM2_LENGTH = 205 # The length of arm 2 (the longer one) in mm
-    BASE_OFFSET = (45+8+8+21) # The total y distance from the center of the platform to the center of the pen tip when the platform is facing the user
+
+
+    # Button bitmask as returned by read_buttons()
+    BUTTON_1 = 1
+    BUTTON_2 = 2
+    BUTTON_3 = 4
+    PROFILE_CHORD = BUTTON_2 | BUTTON_3 # Holding these together switches to the next profile
+
+    # Mouse report button bits, as in adafruit_hid.mouse.Mouse, so the mouse class isn't imported just for these
+    MOUSE_LEFT = 1
+    MOUSE_RIGHT = 2
+    MOUSE_MIDDLE = 4
+
+    # Output reports from the host on the custom HID device: byte 0 is the command, byte 1 its argument
+    REPORT_ID = 4
+    COMMAND_SET_PROFILE = 0x01
+    COMMAND_CAPTURE_PLANE_POINT = 0x02 # Add the current pen position to the drawing plane fit
+    COMMAND_FIT_PLANE = 0x03 # Fit the drawing plane to the captured points and save it
+    COMMAND_ECHO = 0x04 # Latency measurement: the argument comes back in an echo report after the next update
+
+    # Input report answering COMMAND_ECHO on the custom HID device, see send_echo_report() and host/latency.py
+    ECHO_REPORT_ID = 6
+    ECHO_FORMAT = "<BIII"
 
     def __init__(self, 
                  mouse, custom_hid, 
                  rotation_sensor_1, rotation_sensor_2, rotation_sensor_3, 
                  button_1, button_2, button_3,
-                 profile = 0):
+                 profile = 0,
+                 profiles = None,
+                 digitizer = None,
+                 estimator = None,
+                 drawing_plane = None,
+                 kinematics = None,
+                 recorder = None,
+                 macros = None,
+                 scroll = None,
+                 stream = None,
+                 oversampler = None,
+                 power = None):
         
         self.mouse = mouse
         self.custom_hid = custom_hid
+        self.digitizer = digitizer
+        self.estimator = estimator # Optional KalmanEstimator applied to the computed position
+        self.drawing_plane = drawing_plane if drawing_plane is not None else DrawingPlane()
+        self.kinematics = kinematics if kinematics is not None else KinematicChain.from_settings() # Arm geometry
+        self.recorder = recorder # Optional recorder.Recorder that logs the raw sensor counts and buttons of every update
+        self.macros = macros # Optional macros.MacroEngine playing keyboard macros bound to the buttons
+        self.scroll = scroll # scroll.ScrollMapper used by the scroll profile
+        self.stream = stream # Optional stream.SampleStream, gets every sample whatever the profile
+        self.stream_sink = Sink("output_stream")
+        self.oversampler = oversampler # Optional oversampling.Oversampler reading the sensors instead of get_rotations
+        self.power = power # Optional power.PowerManager, fed the deltas and buttons of every update for idle detection
+
+        # Indices of the profiles the chord and the host can switch to, see profiles.enabled_profiles()
+        self.profiles = tuple(profiles) if profiles is not None else tuple(range(len(PROFILES)))
 
-        self.rotation_sensor_1 = rotation_sensor_1
-        self.rotation_sensor_2 = rotation_sensor_2
-        self.rotation_sensor_3 = rotation_sensor_3
+        self.sensors = (rotation_sensor_1, rotation_sensor_2, rotation_sensor_3) # One per joint: arm1, arm2, turntable
 
         self.button_1 = button_1
         self.button_2 = button_2
         self.button_3 = button_3
 
+        self.last_buttons = 0 # Last mouse button state sent to the host
+        self.last_raw_buttons = 0 # Last state returned by read_buttons()
+        self.buttons_held = 0 # Every button pressed since they were last all released
+        self.released_buttons = 0 # buttons_held on the update where the last of them was released, 0 otherwise
+
+        self.raw_position = None # Last position from the kinematics, before any drawing plane rotation
+
+        self.echo_stamp = None # Argument of a COMMAND_ECHO waiting for the next update
+        self.echo_received = 0 # monotonic_ns() when it was seen
+        self.echo_report = bytearray(struct.calcsize(self.ECHO_FORMAT))
+
+        # Shared by the tracking stages, see pipeline.py
+        self.sample = Sample(len(self.sensors))
+        self.raw_counts = self.sample.counts # Last raw 12-bit sensor counts
+        self.offsets = array("f", [0] * len(self.sensors)) # Calibration offsets in radians, one per joint
+        self.accumulator = Accumulator() # Kept across profiles, configured by set_profile()
+        self.pipeline = None
+        self.sensor_config = None # Set by apply_sensor_config() when the sensors apply the offsets and filtering
+
+        self.set_profile(profile)
+
+    def set_profile(self, profile):
+        """
+        Activate a profile from profiles.PROFILES. Its output sinks, filters and sensitivity are
+        bound here once so that update() dispatches with a single call.
+        """
+        if not 0 <= profile < len(PROFILES):
+            raise ValueError("Unknown profile: {}".format(profile))
+        selected = PROFILES[profile]
+
+        # Don't leave buttons held down on the host when leaving mouse mode
+        if self.last_buttons:
+            self.mouse.release_all()
+            self.last_buttons = 0
+        if self.digitizer is not None:
+            self.digitizer.release()
+
         self.profile = profile
+        self.accumulator.configure(selected.sensitivity, selected.acceleration)
+        self._build_pipeline()
+        self._rebase_previous()
+        if self.scroll is not None:
+            self.scroll.reset()
+        self._bind_outputs()
+        print("Profile:", selected.name)
 
+    def _bind_outputs(self):
+        # The sample stream is fed on top of whatever the profile outputs
+        sinks = PROFILES[self.profile].sinks
+        if self.stream is not None:
+            sinks = sinks + (self.stream_sink,)
+        self._output = bind_sinks(self, sinks)
 
-        self.last_buttons = 0
+    def _build_pipeline(self):
+        # Put the tracking stages together for the current profile and options, see pipeline.py
+        selected = PROFILES[self.profile]
+        if self.sensor_config is not None:
+            rotation_filter = ScaleFilter() # The sensors apply the offsets and filtering
+        else:
+            rotation_filter = MovingAverageFilter(self.offsets, selected.smoothing)
+        transforms = []
+        if self.estimator is not None:
+            transforms.append(EstimatorStage(self.estimator))
+        self.plane_stage = PlaneStage(self.drawing_plane, selected.plane_coordinates)
+        transforms.append(self.plane_stage)
+        transforms.append(self.accumulator)
+        self.pipeline = Pipeline(SensorSource(self.sensors, self.oversampler), rotation_filter,
+                                 KinematicsStage(self.kinematics), transforms)
 
-        self.arm1_rotation_moving_average = MovingAverage(size=self.MOUSE_SMOOTHING)
-        self.arm2_rotation_moving_average = MovingAverage(size=self.MOUSE_SMOOTHING)
-        self.turntable_rotation_moving_average = MovingAverage(size=self.MOUSE_SMOOTHING)
+    def _rebase_previous(self):
+        # Express the previous position in the current coordinates so changing them doesn't register as movement
+        if self.raw_position is None:
+            return
+        self.plane_stage.run(self.sample)
+        self.accumulator.rebase(self.sample.position)
+
+    def set_outputs(self, mouse, custom_hid, digitizer=None, macros=None, scroll=None, stream=None):
+        # Attach the HID devices once USB is up, for when the CustomHid was created without them (see prime())
+        self.mouse = mouse
+        self.custom_hid = custom_hid
+        self.digitizer = digitizer
+        self.macros = macros
+        self.scroll = scroll
+        if stream is not self.stream:
+            self.stream = stream
+            self._bind_outputs()
+
+    def prime(self):
+        """
+        Read the sensors and seed the filters and previous position without sending any reports,
+        e.g. while USB is still enumerating. Call after load_calibrations() so the first real
+        update doesn't jump.
+        """
+        self.pipeline.run(self.sample)
+        self.raw_position = self.sample.raw_position
+        self.accumulator.rebase(self.sample.position)
+
+    def snapshot(self):
+        """
+        Read-only copy of the per-axis state, as tuples: (offsets, rotations, previous, accumulation, moves).
+        offsets and rotations have one entry per joint, the others one per axis (x, y, z).
+        """
+        accumulator = self.accumulator
+        return (tuple(self.offsets), tuple(self.sample.rotations), tuple(accumulator.previous),
+                tuple(accumulator.accumulation), tuple(self.sample.moves))
 
-        # Previous coordinates
-        self.previous_x = 0
-        self.previous_y = 0
-        self.previous_z = 0
+    def next_profile(self):
+        profiles = self.profiles
+        index = profiles.index(self.profile) + 1 if self.profile in profiles else 0
+        self.set_profile(profiles[index % len(profiles)])
 
-        self.move_x = 0
-        self.move_y = 0
-        self.move_z = 0
+    def read_buttons(self):
+        # The buttons are pulled up, so a pressed button reads False
+        buttons = 0
+        if not self.button_1.value:
+            buttons |= self.BUTTON_1
+        if not self.button_2.value:
+            buttons |= self.BUTTON_2
+        if not self.button_3.value:
+            buttons |= self.BUTTON_3
+        return buttons
 
-        # Accumulation
-        # TODO: Explain this
-        self.accumulation_x = 0
-        self.accumulation_y = 0
-        self.accumulation_z = 0
+    def poll_host_commands(self):
+        report = self.custom_hid.get_last_received_report(self.REPORT_ID)
+        if report is None:
+            return
+        command = report[0]
+        if command == self.COMMAND_SET_PROFILE and report[1] in self.profiles:
+            self.set_profile(report[1])
+        elif command == self.COMMAND_CAPTURE_PLANE_POINT and self.raw_position is not None:
+            x, y, z = self.raw_position
+            self.drawing_plane.capture_point(x, y, z)
+        elif command == self.COMMAND_FIT_PLANE:
+            if self.drawing_plane.fit():
+                self._rebase_previous()
+                self.save_calibrations()
+        elif command == self.COMMAND_ECHO:
+            self.echo_stamp = report[1]
+            self.echo_received = time.monotonic_ns()
 
-        self.arm1_rotation_offset = 0
-        self.arm2_rotation_offset = 0
-        self.turntable_rotation_offset = 0
+    def apply_sensor_config(self, config):
+        """
+        Have the sensors (SensorMonitors) subtract the calibration offsets and do the smoothing, with the filter
+        settings of config (a sensor_config.SensorConfig). get_rotations() then only scales the angles.
+        Call again after the offsets change.
+        """
+        self.sensor_config = config
+        for sensor, offset in zip(self.sensors, self.offsets):
+            sensor.configure(round(offset * 4096 / (2 * math.pi)) & 0xFFF, config)
+        self._build_pipeline()
 
     def get_rotations(self):
-        arm1_raw_rotation = ((self.rotation_sensor_1.angle / 4096) * 2 * math.pi - self.arm1_rotation_offset) % (2 * math.pi)
-        arm2_raw_rotation = ((self.rotation_sensor_2.angle / 4096) * 2 * math.pi - self.arm2_rotation_offset) % (2 * math.pi)
-        turntable_raw_rotation = ((self.rotation_sensor_3.angle / 4096) * 2 * math.pi - self.turntable_rotation_offset) % (2 * math.pi)
-        # print(self.arm1_rotation_offset)
-
-        arm1_rotation = self.arm1_rotation_moving_average.add(arm1_raw_rotation)
-        arm2_rotation = self.arm2_rotation_moving_average.add(arm2_raw_rotation)
-        turntable_rotation = self.turntable_rotation_moving_average.add(turntable_raw_rotation)
-        # print(math.degrees(arm1_rotation), math.degrees(arm2_rotation), math.degrees(turntable_rotation))
-
-        return arm1_rotation, arm2_rotation, turntable_rotation
-               
+        # Run the source and rotation filter stages only. Returns the sample's rotations array, updated in place.
+        sample = self.sample
+        self.pipeline.source.run(sample)
+        self.pipeline.rotation_filter.run(sample)
+        return sample.rotations
+
     def callibrate(self):
-        arm1_rotation, arm2_rotation, turntable_rotation = self.get_rotations()
-        self.arm1_rotation_offset = arm1_rotation
-        self.arm2_rotation_offset = arm2_rotation
-        self.turntable_rotation_offset = turntable_rotation  
+        rotations = self.get_rotations()
+        offsets = self.offsets
+        for joint in range(len(offsets)):
+            # The rotations are relative to the current offsets, store the absolute angle
+            offsets[joint] = (rotations[joint] + offsets[joint]) % (2 * math.pi)
+        if self.sensor_config is not None:
+            self.apply_sensor_config(self.sensor_config)
+        else:
+            self._build_pipeline() # Start the moving average over, its history is relative to the old offsets
+        # Seed the new zero position, so the next update doesn't report the change of offsets as movement
+        self.prime()
         self.save_calibrations()
-        print("Callibrations saved: ", self.arm1_rotation_offset, self.arm2_rotation_offset, self.turntable_rotation_offset)
+        print("Callibrations saved: ", list(offsets))
         # pass
 
-    # Each offset is stored as a 4-byte float
+    # Each offset is stored as a 4-byte float, followed by the drawing plane (DrawingPlane.FORMAT)
     FORMAT = "fff"  # arm1, arm2, turntable
     def load_calibrations(self):
         size = struct.calcsize(self.FORMAT)
         raw = microcontroller.nvm[:size]
         # If memory looks uninitialized (all 0xFF), set defaults
         if all(b == 0xFF for b in raw):
-            self.arm1_rotation_offset = 0.0
-            self.arm2_rotation_offset = 0.0
-            self.turntable_rotation_offset = 0.0
+            values = (0.0,) * len(self.offsets)
             print("No callibrations values found.")
         else:
             values = struct.unpack(self.FORMAT, raw)
-            self.arm1_rotation_offset, self.arm2_rotation_offset, self.turntable_rotation_offset = values
-            print("Callibrated loaded: ", self.arm1_rotation_offset, self.arm2_rotation_offset, self.turntable_rotation_offset)
+            print("Callibrated loaded: ", values)
+        for joint, value in enumerate(values):
+            self.offsets[joint] = value
+
+        plane_size = struct.calcsize(DrawingPlane.FORMAT)
+        raw = microcontroller.nvm[size:size + plane_size]
+        if all(b == 0xFF for b in raw):
+            print("No drawing plane found, using the default.")
+        elif not self.drawing_plane.unpack(raw):
+            print("Drawing plane in memory is not valid, using the default.")
+        else:
+            print("Drawing plane loaded: ", list(self.drawing_plane.normal), self.drawing_plane.offset)
 
     
     def save_calibrations(self):
-        values = (
-            float(self.arm1_rotation_offset),
-            float(self.arm2_rotation_offset),
-            float(self.turntable_rotation_offset)
-        )
-        data = struct.pack(self.FORMAT, *values)
+        data = struct.pack(self.FORMAT, *self.offsets) + self.drawing_plane.pack()
         buf = microcontroller.nvm[:]  # copy full NVM contents as a slice
         buf[:len(data)] = data        # overwrite start with our data
         microcontroller.nvm[:] = buf  # write back entire slice
         print("Callibrations saved")
 
     def update(self):
-        r1, r2, r3 = self.get_rotations()
-        x, y, z = ArmKinematics.determine_pos(r1, r2, r3, self.ARM1_LENGTH, self.ARM2_LENGTH, self.BASE_OFFSET)
-        print(x, y, z)
-
-        self.accumulation_x += (x - self.previous_x) * self.SENSITIVITY
-        self.accumulation_y += (y - self.previous_y) * self.SENSITIVITY
-        self.accumulation_z += (z - self.previous_z) * self.SENSITIVITY
-
-        self.previous_x = x
-        self.previous_y = y
-        self.previous_z = z
-
-        # TODO: implement threshold to take into account total distance
-        # if abs(self.accumulation_x) >= threshold or abs(self.accumulation_y) >= threshold:
-        move_x = int(self.accumulation_x)
-        move_y = int(self.accumulation_y)
-        move_z = int(self.accumulation_z)
-        # print(move_x, move_y, move_z)
-        
-        self.accumulation_x -= move_x
-        self.accumulation_y -= move_y
-        self.accumulation_z -= move_z
+        sample = self.sample
+        sample_time = time.monotonic_ns() if self.echo_stamp is not None else 0 # Before the sensors are read
+        for stage in self.pipeline.stages:
+            stage(sample)
+        self.raw_position = sample.raw_position
+        deltas = sample.deltas
+        moves = sample.moves
+
+        buttons = self.read_buttons()
+        if self.recorder is not None:
+            self.recorder.record(self.raw_counts, buttons)
+        if self.power is not None:
+            self.power.update(deltas[0], deltas[1], deltas[2], buttons)
+        released = 0
+        if buttons != self.last_raw_buttons:
+            self.last_raw_buttons = buttons
+            if buttons:
+                self.buttons_held |= buttons
+            else:
+                released = self.buttons_held
+                self.buttons_held = 0
+            if buttons == self.PROFILE_CHORD:
+                self.next_profile()
+                if self.macros is not None:
+                    self.macros.cancel() # The chord's buttons don't play their macros
+            if self.macros is not None:
+                self.macros.trigger(buttons & self.macros.mask)
+        self.released_buttons = released
+        if buttons == self.PROFILE_CHORD:
+            buttons = 0 # The chord is consumed by the profile switch
+        if self.macros is not None:
+            buttons &= ~self.macros.mask # Buttons with macros don't click
+            self.macros.tick()
 
-        self.profile = 1
-        if self.profile == 0:
-            self.send_mouse_report(move_x, move_y, z)
-        if self.profile == 1:
-            self.send_custom_hid_report(move_x, move_y, move_z, 0, r1, r2, r3)
+        self._output(moves[0], moves[1], moves[2], sample.position, sample.rotations, buttons)
+        if sample_time:
+            self.send_echo_report(sample_time)
+        self.poll_host_commands()
 
+    # Output handlers, bound through the profile's sinks by set_profile(). They all take the same arguments:
+    # (move_x, move_y, move_z, (x, y, z), (r1, r2, r3), buttons)
 
-    def send_mouse_report(self, move_x, move_y, z_pos):
-        # Only move if non-zero
-        # print(z_pos)
-        if (move_x or move_y) and z_pos < -160:
+    def output_mouse(self, move_x, move_y, move_z, position, rotations, buttons):
+        self.send_mouse_report(move_x, move_y, self.drawing_plane.pen_down, buttons)
+
+    def output_serial(self, move_x, move_y, move_z, position, rotations, buttons):
+        print(position[0], position[1], position[2])
+
+    def output_custom_hid(self, move_x, move_y, move_z, position, rotations, buttons):
+        self.send_custom_hid_report(move_x, move_y, move_z, buttons, rotations[0], rotations[1], rotations[2])
+
+    def output_pen(self, move_x, move_y, move_z, position, rotations, buttons):
+        if self.digitizer is None:
+            return
+        plane = self.drawing_plane
+        self.digitizer.send(position[0], position[1], plane.distance, plane.pen_down, buttons & self.BUTTON_2)
+
+    def output_scroll(self, move_x, move_y, move_z, position, rotations, buttons):
+        if self.scroll is not None:
+            self.scroll.update(position, rotations)
+        self.send_mouse_report(0, 0, False, buttons) # Buttons still click
+
+    def output_stream(self, move_x, move_y, move_z, position, rotations, buttons):
+        # The arm's x, y, z in mm, whatever coordinates the profile uses for position
+        self.stream.send(self.sample.raw_position, self.raw_counts, buttons, self.profile)
+
+    def send_mouse_report(self, move_x, move_y, pen_down, raw_buttons):
+        # Only move if non-zero and the pen is on the drawing plane
+        if (move_x or move_y) and pen_down:
             self.mouse.move(move_x, move_y)
 
-        if not self.button_1.value:
-            print("button") 
         # Build button state bitmask
         buttons = 0
-        if not self.button_1.value:
-            buttons |= Mouse.LEFT_BUTTON
-        if not self.button_2.value:
-            buttons |= Mouse.RIGHT_BUTTON
-        if not self.button_3.value:
+        if raw_buttons & self.BUTTON_1:
+            buttons |= self.MOUSE_LEFT
+        if raw_buttons & self.BUTTON_2:
+            buttons |= self.MOUSE_RIGHT
+        # BUTTON_3 calibrates once it is released, and only if no other button was held with it, so the
+        # profile chord (which includes it) doesn't recalibrate on the way in or out
+        if self.released_buttons == self.BUTTON_3 and (self.macros is None or not self.macros.mask & self.BUTTON_3):
             self.callibrate() #TODO: Probably replace this
 
         # Only send button state if it changed
         if buttons != self.last_buttons:
             self.mouse.release_all()
-            if buttons & Mouse.LEFT_BUTTON:
-                self.mouse.press(Mouse.LEFT_BUTTON)
-            if buttons & Mouse.RIGHT_BUTTON:
-                self.mouse.press(Mouse.RIGHT_BUTTON)
-            if buttons & Mouse.MIDDLE_BUTTON:
-                self.mouse.press(Mouse.MIDDLE_BUTTON)
+            if buttons & self.MOUSE_LEFT:
+                self.mouse.press(self.MOUSE_LEFT)
+            if buttons & self.MOUSE_RIGHT:
+                self.mouse.press(self.MOUSE_RIGHT)
+            if buttons & self.MOUSE_MIDDLE:
+                self.mouse.press(self.MOUSE_MIDDLE)
 
             self.last_buttons = buttons
 
@@ -199,4 +405,19 @@ class CustomHid:
         # Send to HID device
         self.custom_hid.send_report(report)
 
+    def send_echo_report(self, sample_time):
+        """
+        Answer a COMMAND_ECHO, right after the reports of the update that followed it. 13 bytes, times in
+        microseconds of the device clock (time.monotonic_ns() // 1000, wrapping):
+        Byte 0: the command's argument (stamp)
+        Bytes 1-4: when the update started reading the sensors (sample_time, in ns)
+        Bytes 5-8: when the command was seen by poll_host_commands()
+        Bytes 9-12: when this report is sent
+        """
+        struct.pack_into(self.ECHO_FORMAT, self.echo_report, 0, self.echo_stamp,
+                         (sample_time // 1000) & 0xFFFFFFFF, (self.echo_received // 1000) & 0xFFFFFFFF,
+                         (time.monotonic_ns() // 1000) & 0xFFFFFFFF)
+        self.echo_stamp = None
+        self.custom_hid.send_report(self.echo_report, self.ECHO_REPORT_ID)
+
 5
\ No newline at end of file
@@ -0,0 +1,87 @@
+# digitizer.py
+# Absolute pen digitizer, paired with DIGITIZER_DESCRIPTOR in boot.py.
+# Instead of relative mouse deltas, the pen position inside a workspace rectangle (mm) is mapped straight
+# onto the screen, so every update is one absolute report with nothing to accumulate or split.
+import struct
+from adafruit_hid import find_device
+
+class Digitizer:
+
+    USAGE_PAGE = 0x0D # Digitizer
+    USAGE = 0x02 # Pen
+
+    MAX_POSITION = 32767 # Logical maximum of X and Y in the descriptor
+    MAX_PRESSURE = 1023 # Logical maximum of Tip Pressure in the descriptor
+
+    # Report byte 0 flags
+    TIP_SWITCH = 1
+    BARREL_SWITCH = 2
+    IN_RANGE = 4
+
+    def __init__(self, devices,
+                 workspace=(-150, 40, 150, 210),
+                 hover_height=30,
+                 pressure_depth=10,
+                 timeout=None):
+        """
+        workspace: (x_min, y_min, x_max, y_max) in mm on the drawing plane, mapped onto the whole screen. y_min is the top edge.
+        hover_height: How far above the drawing plane (mm) the pen is still reported as in range.
+        pressure_depth: Depth below the surface (mm) that gives full pressure.
+        """
+        self._device = find_device(devices, usage_page=self.USAGE_PAGE, usage=self.USAGE, timeout=timeout)
+
+        self.set_workspace(workspace)
+        self.hover_height = hover_height
+        self.pressure_scale = self.MAX_PRESSURE / pressure_depth
+
+        # Reuse this bytearray to send digitizer reports.
+        # report[0] flags (tip, barrel, in range)
+        # report[1:3] x
+        # report[3:5] y
+        # report[5:7] tip pressure
+        self.report = bytearray(7)
+        self._in_range = False
+
+    def set_workspace(self, workspace):
+        x_min, y_min, x_max, y_max = workspace
+        self.x_min = x_min
+        self.y_min = y_min
+        # Precompute the mm -> logical unit scale so send() is a multiply per axis
+        self.x_scale = self.MAX_POSITION / (x_max - x_min)
+        self.y_scale = self.MAX_POSITION / (y_max - y_min)
+
+    def send(self, x, y, distance, tip, barrel=False):
+        """
+        Send one absolute report for a pen position in mm. distance is the signed distance to the drawing plane
+        and tip whether the plane considers the pen down (see DrawingPlane.update). Nothing is sent while the pen
+        stays out of range, apart from the single report that tells the host it left.
+        """
+        in_range = tip or distance < self.hover_height
+        if not in_range and not self._in_range:
+            return
+        self._in_range = in_range
+
+        flags = 0
+        pressure = 0
+        if in_range:
+            flags = self.IN_RANGE
+            if tip:
+                flags |= self.TIP_SWITCH
+                if distance < 0:
+                    pressure = min(self.MAX_PRESSURE, int(-distance * self.pressure_scale))
+            if barrel:
+                flags |= self.BARREL_SWITCH
+
+        logical_x = min(self.MAX_POSITION, max(0, int((x - self.x_min) * self.x_scale)))
+        logical_y = min(self.MAX_POSITION, max(0, int((y - self.y_min) * self.y_scale)))
+        struct.pack_into("<BHHH", self.report, 0, flags, logical_x, logical_y, pressure)
+        self._device.send_report(self.report)
+
+    def release(self):
+        # Tell the host the pen left, e.g. when switching to another profile
+        if self._in_range:
+            self._in_range = False
+            self.report[0] = 0
+            self.report[5] = 0
+            self.report[6] = 0
+            self._device.send_report(self.report)
@@ -0,0 +1,160 @@
+# drawing_plane.py
+# A virtual drawing surface in any orientation, fitted from a few points touched with the pen.
+# The plane is kept as a unit normal and an offset so the signed distance of the pen tip is one dot product
+# per update. Separate enter and exit distances give the pen-down state some hysteresis so it doesn't
+# flicker while the tip rests on the surface.
+import math
+import struct
+from array import array
+
+class DrawingPlane:
+
+    FORMAT = "ffff" # Normal x, y, z and offset, as stored with the calibrations
+
+    def __init__(self, normal=(0.0, 0.0, 1.0), offset=-160.0, enter_distance=0.0, exit_distance=3.0):
+        """
+        normal, offset: The plane is every point p where dot(normal, p) == offset. The default is the
+                        horizontal surface 160 mm below the arm.
+        enter_distance: The pen goes down once it is closer than this to the plane (mm, negative is below).
+        exit_distance: The pen goes back up once it is further than this above the plane (mm).
+        """
+        self.enter_distance = enter_distance
+        self.exit_distance = exit_distance
+
+        self.normal = array("f", (0.0, 0.0, 1.0))
+        self.u_axis = array("f", (1.0, 0.0, 0.0)) # In-plane axes, used by to_plane()
+        self.v_axis = array("f", (0.0, 1.0, 0.0))
+        self.plane_position = array("f", (0.0, 0.0, 0.0))
+        self.offset = 0.0
+        self.set_plane(normal, offset)
+
+        self.distance = 0.0 # Signed distance of the last update, positive above the plane
+        self.pen_down = False
+
+        self.points = [] # Points captured for the next fit()
+
+    def set_plane(self, normal, offset):
+        nx, ny, nz = normal
+        length = math.sqrt(nx * nx + ny * ny + nz * nz)
+        nx /= length
+        ny /= length
+        nz /= length
+        offset /= length
+        # Point the normal away from the surface, which is the side the arm's base is on
+        if offset > 0:
+            nx, ny, nz, offset = -nx, -ny, -nz, -offset
+        self.normal[0] = nx
+        self.normal[1] = ny
+        self.normal[2] = nz
+        self.offset = offset
+
+        # The in-plane u axis follows x as closely as possible (or y if the plane is perpendicular to x),
+        # v completes the right handed set with the normal.
+        if abs(nx) < 0.9:
+            ax, ay, az = 1.0, 0.0, 0.0
+        else:
+            ax, ay, az = 0.0, 1.0, 0.0
+        dot = ax * nx + ay * ny + az * nz
+        ux, uy, uz = ax - dot * nx, ay - dot * ny, az - dot * nz
+        length = math.sqrt(ux * ux + uy * uy + uz * uz)
+        ux /= length
+        uy /= length
+        uz /= length
+        self.u_axis[0] = ux
+        self.u_axis[1] = uy
+        self.u_axis[2] = uz
+        self.v_axis[0] = ny * uz - nz * uy
+        self.v_axis[1] = nz * ux - nx * uz
+        self.v_axis[2] = nx * uy - ny * ux
+
+    def update(self, x, y, z):
+        # Evaluate the signed distance of the pen tip and return whether the pen is down
+        n = self.normal
+        distance = n[0] * x + n[1] * y + n[2] * z - self.offset
+        self.distance = distance
+        if self.pen_down:
+            if distance > self.exit_distance:
+                self.pen_down = False
+        elif distance < self.enter_distance:
+            self.pen_down = True
+        return self.pen_down
+
+    def to_plane(self, x, y, z):
+        """
+        Rotate a point into plane coordinates (u, v, distance). The returned array is reused on the next call.
+        """
+        u = self.u_axis
+        v = self.v_axis
+        n = self.normal
+        out = self.plane_position
+        out[0] = u[0] * x + u[1] * y + u[2] * z
+        out[1] = v[0] * x + v[1] * y + v[2] * z
+        out[2] = n[0] * x + n[1] * y + n[2] * z - self.offset
+        return out
+
+    def capture_point(self, x, y, z):
+        self.points.append((x, y, z))
+        print("Plane point", len(self.points), ":", x, y, z)
+
+    def fit(self):
+        """
+        Least squares fit of the plane through the captured points (at least 3). Returns True on success.
+        """
+        points = self.points
+        count = len(points)
+        if count < 3:
+            print("Need at least 3 points to fit a plane, have", count)
+            return False
+
+        cx = sum(p[0] for p in points) / count
+        cy = sum(p[1] for p in points) / count
+        cz = sum(p[2] for p in points) / count
+
+        # Covariance of the points around their centroid
+        xx = xy = xz = yy = yz = zz = 0.0
+        for px, py, pz in points:
+            dx, dy, dz = px - cx, py - cy, pz - cz
+            xx += dx * dx
+            xy += dx * dy
+            xz += dx * dz
+            yy += dy * dy
+            yz += dy * dz
+            zz += dz * dz
+
+        # The normal is the direction of least variance. Solve with whichever axis gives the best conditioned system.
+        det_x = yy * zz - yz * yz
+        det_y = xx * zz - xz * xz
+        det_z = xx * yy - xy * xy
+        det_max = max(det_x, det_y, det_z)
+        if det_max <= 0:
+            print("Plane points are on a line, capture points further apart")
+            return False
+        if det_max == det_x:
+            normal = (det_x, xz * yz - xy * zz, xy * yz - xz * yy)
+        elif det_max == det_y:
+            normal = (xz * yz - xy * zz, det_y, xy * xz - yz * xx)
+        else:
+            normal = (xy * yz - xz * yy, xy * xz - yz * xx, det_z)
+
+        length = math.sqrt(normal[0] ** 2 + normal[1] ** 2 + normal[2] ** 2)
+        offset = (normal[0] * cx + normal[1] * cy + normal[2] * cz) / length
+        self.set_plane((normal[0] / length, normal[1] / length, normal[2] / length), offset)
+        self.points = []
+        print("Plane fitted:", list(self.normal), self.offset)
+        return True
+
+    def pack(self):
+        n = self.normal
+        return struct.pack(self.FORMAT, n[0], n[1], n[2], self.offset)
+
+    def unpack(self, raw):
+        """
+        Set the plane from bytes made by pack(). Returns False and keeps the current plane if they don't hold
+        a usable plane (a zero or non-finite normal, or a non-finite offset), e.g. after the NVM was cleared.
+        """
+        nx, ny, nz, offset = struct.unpack(self.FORMAT, raw)
+        length = math.sqrt(nx * nx + ny * ny + nz * nz)
+        if not (math.isfinite(length) and length > 0 and math.isfinite(offset)):
+            return False
+        self.set_plane((nx, ny, nz), offset)
+        return True
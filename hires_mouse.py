@@ -0,0 +1,72 @@
+# hires_mouse.py
+# Drop-in replacement for adafruit_hid.mouse.Mouse for HIRES_MOUSE_DESCRIPTOR in boot.py.
+# X, Y, wheel and pan are 16 bits wide, so move() always sends exactly one report instead of
+# splitting anything larger than +-127 into several 8-bit reports.
+# The wheel and pan also have a Resolution Multiplier: once the host enables it, one detent is
+# RESOLUTION units instead of 1, which allows smooth scrolling (see scroll.py).
+import struct
+from adafruit_hid import find_device
+
+class HiResMouse:
+
+    LEFT_BUTTON = 1
+    RIGHT_BUTTON = 2
+    MIDDLE_BUTTON = 4
+    BACK_BUTTON = 8
+    FORWARD_BUTTON = 16
+
+    LIMIT = 32767 # Logical maximum of the 16-bit axes in the descriptor
+    RESOLUTION = 120 # Physical maximum of the Resolution Multipliers
+
+    def __init__(self, devices, timeout=None):
+        self._mouse_device = find_device(devices, usage_page=0x1, usage=0x02, timeout=timeout)
+
+        # Reuse this bytearray to send mouse reports.
+        # report[0] buttons pressed
+        # report[1:3] x movement
+        # report[3:5] y movement
+        # report[5:7] wheel movement
+        # report[7:9] horizontal pan
+        self.report = bytearray(9)
+
+        # Units per wheel/pan detent. 1 until the host sets the Resolution Multiplier with a feature report
+        # (poll_multipliers), the default in the HID spec, so hosts that never set it don't scroll 120 times too far.
+        self.wheel_multiplier = 1
+        self.pan_multiplier = 1
+
+    def press(self, buttons):
+        self.report[0] |= buttons
+        self._send_no_move()
+
+    def release(self, buttons):
+        self.report[0] &= ~buttons
+        self._send_no_move()
+
+    def release_all(self):
+        self.report[0] = 0
+        self._send_no_move()
+
+    def click(self, buttons):
+        self.press(buttons)
+        self.release(buttons)
+
+    def move(self, x=0, y=0, wheel=0, pan=0):
+        # Same arguments as Mouse.move(), plus horizontal pan. Always a single report.
+        limit = self.LIMIT
+        struct.pack_into("<hhhh", self.report, 1,
+                         min(limit, max(-limit, x)),
+                         min(limit, max(-limit, y)),
+                         min(limit, max(-limit, wheel)),
+                         min(limit, max(-limit, pan)))
+        self._mouse_device.send_report(self.report)
+
+    def poll_multipliers(self):
+        # Pick up a Resolution Multiplier feature report from the host: bits 0-1 wheel, bits 2-3 pan
+        report = self._mouse_device.get_last_received_report()
+        if report is not None:
+            self.wheel_multiplier = self.RESOLUTION if report[0] & 0x03 else 1
+            self.pan_multiplier = self.RESOLUTION if report[0] & 0x0C else 1
+
+    def _send_no_move(self):
+        struct.pack_into("<hhhh", self.report, 1, 0, 0, 0, 0)
+        self._mouse_device.send_report(self.report)
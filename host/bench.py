@@ -0,0 +1,207 @@
+# bench.py
+# Benchmarks the firmware hot paths and the bundled adafruit_hid on a computer, using the stand-ins from
+# standins.py. For each benchmark it measures the time per call (best of several runs, to keep noise down) and
+# the peak memory a single call allocates, and compares them against baselines so regressions get flagged.
+#
+#   python host/bench.py                 Run and compare
+#   python host/bench.py --save          Run and save the timing baseline for this computer
+#   python host/bench.py --only kinematics --output results.json
+#
+# Absolute times depend on the computer (and are much lower than on the pen), so times are only compared
+# against a baseline saved with --save on the same computer (host/bench_local.json, not committed). Without
+# one the times are just printed. The allocations don't depend on the computer: host/bench_baseline.json in
+# the repo has the peak bytes of every benchmark, update it with --save-peaks. The exit code is 1 when
+# anything regressed.
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import standins
+
+HOST = os.path.dirname(os.path.abspath(__file__))
+PEAKS = os.path.join(HOST, "bench_baseline.json") # Committed, peak bytes only
+BASELINE = os.path.join(HOST, "bench_local.json") # This computer's times and peaks, saved with --save
+
+
+def build_benchmarks():
+    # Returns a list of (name, function to call, calls per run)
+    standins.install()
+    from adafruit_hid.keyboard import Keyboard
+    from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
+    from adafruit_hid.keycode import Keycode
+    from adafruit_hid.mouse import Mouse
+    from kinematics import ArmKinematics, KinematicChain
+    from moving_average import MovingAverage
+    from nkro_keyboard import NkroKeyboard
+    from pipeline import Sample, MovingAverageFilter, ScaleFilter, KinematicsStage, PlaneStage, Accumulator
+
+    device, sensors, buttons, devices = standins.make_custom_hid(profile=1, keep_reports=False)
+    sensors[0].angle = 1000
+    sensors[1].angle = 2000
+    sensors[2].angle = 3000
+
+    moving_average = MovingAverage(size=3)
+
+    # Pipeline stages on their own, each on a sample filled by the stages before it
+    sample = Sample()
+    device.pipeline.source.run(sample)
+    moving_average_filter = MovingAverageFilter(device.offsets, smoothing=3)
+    moving_average_filter.run(sample)
+    scale_filter = ScaleFilter()
+    kinematics_stage = KinematicsStage(KinematicChain.from_settings())
+    kinematics_stage.run(sample)
+    plane_stage = PlaneStage(device.drawing_plane, plane_coordinates=True)
+    accumulator = Accumulator()
+    accumulator.configure(10)
+    chain = KinematicChain.from_settings()
+    rotations = (0.3, 1.2, 0.7)
+    mouse = Mouse(standins.FakeHidDevice(0x01, 0x02, keep_reports=False))
+    keyboard = Keyboard(standins.FakeHidDevice(0x01, 0x06, keep_reports=False))
+    layout = KeyboardLayoutUS(keyboard)
+    nkro_keyboard = NkroKeyboard(standins.FakeHidDevice(0x01, 0x06, keep_reports=False))
+
+    def keyboard_press_release():
+        keyboard.press(Keycode.CONTROL, Keycode.SHIFT, Keycode.A, Keycode.B, Keycode.C)
+        keyboard.release(Keycode.A, Keycode.B, Keycode.C, Keycode.SHIFT, Keycode.CONTROL)
+
+    def nkro_keyboard_press_release():
+        nkro_keyboard.press(Keycode.CONTROL, Keycode.SHIFT, Keycode.A, Keycode.B, Keycode.C)
+        nkro_keyboard.release(Keycode.A, Keycode.B, Keycode.C, Keycode.SHIFT, Keycode.CONTROL)
+
+    return [
+        ("moving_average.add", lambda: moving_average.add(1.5), 100000),
+        ("arm_kinematics.determine_pos", lambda: ArmKinematics.determine_pos(0.3, 1.2, 0.7, 170, 205, 82), 100000),
+        ("kinematic_chain.determine_pos", lambda: chain.determine_pos(rotations), 100000),
+        ("pipeline.sensor_source", lambda: device.pipeline.source.run(sample), 100000),
+        ("pipeline.moving_average_filter", lambda: moving_average_filter.run(sample), 100000),
+        ("pipeline.scale_filter", lambda: scale_filter.run(sample), 100000),
+        ("pipeline.kinematics_stage", lambda: kinematics_stage.run(sample), 100000),
+        ("pipeline.plane_stage", lambda: plane_stage.run(sample), 100000),
+        ("pipeline.accumulator", lambda: accumulator.run(sample), 100000),
+        ("custom_hid.get_rotations", device.get_rotations, 50000),
+        ("custom_hid.send_custom_hid_report", lambda: device.send_custom_hid_report(5, -5, 1, 3, 0.1, 0.2, 0.3), 50000),
+        ("custom_hid.update", device.update, 20000),
+        ("mouse.move_large", lambda: mouse.move(1000, -1000), 20000),
+        ("keyboard.press_release", keyboard_press_release, 20000),
+        ("nkro_keyboard.press_release", nkro_keyboard_press_release, 20000),
+        ("keyboard_layout_us.write", lambda: layout.write("Hello, World!"), 2000),
+    ]
+
+
+def run(name, func, number, repeat=5):
+    # Warm up, then time the calls. Allocations are measured on a separate single call.
+    for _ in range(min(number, 1000)):
+        func()
+    elapsed = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        run_time = time.perf_counter_ns() - start
+        if elapsed is None or run_time < elapsed:
+            elapsed = run_time
+
+    peak_bytes = None
+    tracemalloc.start()
+    for _ in range(repeat):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        if peak_bytes is None or peak - before < peak_bytes:
+            peak_bytes = peak - before
+    tracemalloc.stop()
+
+    return {"us_per_call": round(elapsed / number / 1000, 4), "peak_bytes": peak_bytes}
+
+
+def compare(results, peaks, baseline, tolerance):
+    """
+    Print the results next to the baseline and return the names of the benchmarks that regressed: slower than
+    tolerance allows (only against a baseline from this computer) or allocating more than either baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        peak = peaks.get(name, base)
+        if base is None and peak is None:
+            status = "new"
+        elif peak is not None and result["peak_bytes"] > peak["peak_bytes"] or \
+                base is not None and (result["us_per_call"] > base["us_per_call"] * (1 + tolerance)
+                                      or result["peak_bytes"] > base["peak_bytes"]):
+            status = "REGRESSION"
+            regressions.append(name)
+        elif base is not None and result["us_per_call"] < base["us_per_call"] * (1 - tolerance):
+            status = "faster"
+        else:
+            status = "ok"
+        base_time = "{:10.3f} us".format(base["us_per_call"]) if base else " " * 13
+        print("{:40} {:10.3f} us {} {:6} B  {}".format(name, result["us_per_call"], base_time, result["peak_bytes"], status))
+    return regressions
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def save_results(path, results, only):
+    # Write results to path. With --only the other benchmarks already in the file are kept.
+    if only:
+        saved = load_results(path)
+        saved.update(results)
+        results = saved
+    with open(path, "w") as f:
+        json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Mobi3-Pen firmware hot paths")
+    parser.add_argument("--baseline", default=BASELINE, help="Timing baseline of this computer to compare against")
+    parser.add_argument("--save", action="store_true", help="Save the results as this computer's timing baseline")
+    parser.add_argument("--save-peaks", action="store_true", help="Save the peak bytes to the committed baseline")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--only", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging, default 0.2 (20%%)")
+    args = parser.parse_args()
+
+    results = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull): # CustomHid prints every update
+        for name, func, number in build_benchmarks():
+            if args.only and args.only not in name:
+                continue
+            results[name] = run(name, func, number)
+
+    peaks = load_results(PEAKS)
+    baseline = load_results(args.baseline)
+
+    print("{:40} {:>13} {:>13} {:>8}".format("benchmark", "time", "baseline", "peak"))
+    regressions = compare(results, peaks, baseline, args.tolerance)
+    if not baseline:
+        print("No timing baseline for this computer yet, times weren't compared. Save one with --save.")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2, sort_keys=True)
+    if args.save_peaks:
+        save_results(PEAKS, {name: {"peak_bytes": result["peak_bytes"]} for name, result in results.items()}, args.only)
+        print("Peak bytes saved to", PEAKS)
+    if args.save:
+        save_results(args.baseline, results, args.only)
+        print("Baseline saved to", args.baseline)
+    if args.save or args.save_peaks:
+        return 0
+    if regressions:
+        print("Regressed:", ", ".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+# broadcaster.py
+# Host daemon that owns the pen's custom HID device, decodes each report once and broadcasts it to any number
+# of local subscribers over UDP multicast and WebSocket. Several tools (the Overlay, the Blender addon, a
+# recorder...) can then follow one pen without fighting over the device or each decoding the reports.
+#
+#   python host/broadcaster.py [--multicast 239.255.42.1:5005] [--websocket 127.0.0.1:8765] [--ring [PATH]]
+#
+# Needs the hidapi bindings (pip install hidapi).
+#
+# Every subscriber gets the same 36 byte little-endian packet (a binary frame on WebSocket):
+#   uint32  sequence number, increases by one per report
+#   float64 host receive time in seconds (time.time())
+#   int8    delta x, delta y, delta z
+#   uint8   buttons
+#   float32 rotation of arm1, arm2 and the turntable in radians (the floats of the custom report, see
+#           CustomHid.output_custom_hid), not a position
+#   uint32  reserved, 0
+# With --ring the reports are also written to a shared memory ring (shm_ring.py), as records of kind
+# KIND_ROTATIONS: the rotations go into the x, y and z of the records as they are.
+import argparse
+import asyncio
+import base64
+import hashlib
+import socket
+import struct
+import time
+
+import shm_ring
+
+VID = 0x239A
+PID = 0x80F4
+USAGE_PAGE = 0xFF00
+REPORT_ID = 4
+REPORT_FORMAT = "<bbbBfff" # The custom HID report after the report ID
+
+PACKET_FORMAT = "<IdbbbBfffI"
+PACKET_SIZE = struct.calcsize(PACKET_FORMAT)
+FRAME_FORMAT = "<BB" + PACKET_FORMAT[1:] # The packet in a WebSocket frame (2 byte header, short binary message)
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def open_device(vid=VID, pid=PID):
+    # Open the custom HID interface of the pen with hidapi
+    try:
+        import hid
+    except ImportError:
+        raise SystemExit("The hidapi package is needed to read the pen: pip install hidapi")
+    for info in hid.enumerate(vid, pid):
+        if info["usage_page"] == USAGE_PAGE:
+            device = hid.device()
+            device.open_path(info["path"])
+            return device
+    raise SystemExit("No Mobi3-Pen custom HID device found ({:04x}:{:04x})".format(vid, pid))
+
+
+class Broadcaster:
+
+    def __init__(self):
+        self.sequence = 0
+
+        self.publishers = [] # Anything with publish(packet), e.g. MulticastPublisher
+        self.websocket_clients = set()
+        self.max_buffered = 64 * 1024 # Frames to a WebSocket client with more than this queued are dropped
+
+    def handle_report(self, report):
+        # Decode one raw report (with the report ID first, as hidapi returns it) and send it everywhere
+        if len(report) < 1 + struct.calcsize(REPORT_FORMAT) or report[0] != REPORT_ID:
+            return
+        dx, dy, dz, buttons, r1, r2, r3 = struct.unpack_from(REPORT_FORMAT, bytes(report), 1)
+        # Packed once, as the WebSocket frame (FIN, binary) around the packet. The same immutable bytes go to
+        # every subscriber, so they stay valid however long the writers take to drain.
+        frame = struct.pack(FRAME_FORMAT, 0x82, PACKET_SIZE,
+                            self.sequence, time.time(), dx, dy, dz, buttons, r1, r2, r3, 0)
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+
+        packet = memoryview(frame)[2:]
+        for publisher in self.publishers:
+            publisher.publish(packet)
+        for writer in tuple(self.websocket_clients):
+            if writer.transport.get_write_buffer_size() < self.max_buffered:
+                writer.write(frame)
+
+    async def serve_websocket(self, reader, writer):
+        # Minimal RFC 6455 server: handshake, then only send. Anything the client sends is ignored.
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        key = None
+        for line in request.split(b"\r\n"):
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"sec-websocket-key":
+                key = value.strip()
+        if key is None:
+            writer.write(b"HTTP/1.1 400 Bad Request\r\n\r\n")
+            writer.close()
+            return
+        accept = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest())
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                     b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+
+        self.websocket_clients.add(writer)
+        try:
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self.websocket_clients.discard(writer)
+            writer.close()
+
+
+class MulticastPublisher:
+
+    def __init__(self, group, port, ttl=0):
+        # ttl 0 keeps the packets on this computer
+        self.address = (group, port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+
+    def publish(self, packet):
+        self.socket.sendto(packet, self.address)
+
+
+class RingPublisher:
+
+    def __init__(self, path):
+        self.writer = shm_ring.RingWriter(path)
+
+    def publish(self, packet):
+        _, host_time, dx, dy, dz, buttons, r1, r2, r3, _ = struct.unpack_from(PACKET_FORMAT, packet)
+        self.writer.write(host_time, 0, r1, r2, r3, dx=dx, dy=dy, dz=dz, buttons=buttons, kind=shm_ring.KIND_ROTATIONS)
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    return host, int(port)
+
+
+async def run(args):
+    broadcaster = Broadcaster()
+    if args.multicast:
+        group, port = parse_address(args.multicast)
+        broadcaster.publishers.append(MulticastPublisher(group, port))
+    if args.ring:
+        broadcaster.publishers.append(RingPublisher(args.ring))
+    if args.websocket:
+        host, port = parse_address(args.websocket)
+        await asyncio.start_server(broadcaster.serve_websocket, host, port)
+
+    device = open_device(args.vid, args.pid)
+    loop = asyncio.get_running_loop()
+    print("Broadcasting the pen on", args.multicast or "-", "(UDP) and", args.websocket or "-", "(WebSocket)")
+    while True:
+        # hidapi blocks, so read in a worker thread and publish on the event loop
+        report = await loop.run_in_executor(None, device.read, 64, 1000)
+        if report:
+            broadcaster.handle_report(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Share the Mobi3-Pen's custom HID reports with local subscribers")
+    parser.add_argument("--multicast", default="239.255.42.1:5005", help="UDP multicast group:port, empty to disable")
+    parser.add_argument("--websocket", default="127.0.0.1:8765", help="WebSocket host:port, empty to disable")
+    parser.add_argument("--ring", nargs="?", const=shm_ring.DEFAULT_PATH, help="Also publish to a shared memory ring (shm_ring.py)")
+    parser.add_argument("--vid", type=lambda value: int(value, 0), default=VID)
+    parser.add_argument("--pid", type=lambda value: int(value, 0), default=PID)
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
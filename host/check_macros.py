@@ -0,0 +1,84 @@
+# check_macros.py
+# Checks when macros.py plays button macros, driving an unmodified CustomHid with fake buttons. A macro must play
+# once, after the buttons are released, for the largest combination that was held: pressing or releasing the
+# buttons of a combination one after another must not play the macros of the single buttons on the way, and the
+# profile chord must not play any.
+#
+#   python host/check_macros.py
+#
+# Prints one line per check and exits with 1 if any of them fail.
+import contextlib
+import io
+import sys
+
+import standins
+
+standins.install()
+from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
+from adafruit_hid.keycode import Keycode
+from custom_hid import CustomHid
+from macros import MacroEngine
+
+BUTTON_1 = CustomHid.BUTTON_1
+BUTTON_2 = CustomHid.BUTTON_2
+BUTTON_3 = CustomHid.BUTTON_3
+BINDINGS = {BUTTON_1: (Keycode.CONTROL, Keycode.Z), BUTTON_1 | BUTTON_2: "Hello!", BUTTON_2: "b2"}
+
+failures = []
+
+def check(name, condition):
+    print("{:60} {}".format(name, "ok" if condition else "FAILED"))
+    if not condition:
+        failures.append(name)
+
+
+def play(steps, profile=1, release=True):
+    """
+    Press the buttons of each step (a button mask) for one update each, then let the queued macros finish,
+    with the buttons released (or still held as in the last step if release is False).
+    Returns the keyboard reports sent, and the CustomHid.
+    """
+    keyboard = standins.FakeHidDevice(0x01, 0x06)
+    macros = MacroEngine(keyboard, KeyboardLayoutUS(None), BINDINGS)
+    with contextlib.redirect_stdout(io.StringIO()):
+        device, sensors, buttons, devices = standins.make_custom_hid(profile=profile, macros=macros)
+        for step in list(steps) + [0 if release else steps[-1]] * 40:
+            for i, button in enumerate(buttons):
+                button.value = not step & (1 << i) # Pulled up, so pressed reads False
+            device.update()
+    return b"".join(keyboard.reports), device
+
+
+def expected(*combinations):
+    engine = MacroEngine(standins.FakeHidDevice(0x01, 0x06), KeyboardLayoutUS(None), BINDINGS)
+    return b"".join(engine.bindings[combination] for combination in combinations)
+
+
+def main():
+    reports, _ = play([BUTTON_1, BUTTON_1, 0])
+    check("single button plays its macro once", reports == expected(BUTTON_1))
+
+    reports, _ = play([BUTTON_1, BUTTON_1 | BUTTON_2, BUTTON_2, 0])
+    check("staggered press and release plays only the combination", reports == expected(BUTTON_1 | BUTTON_2))
+
+    reports, _ = play([BUTTON_2, BUTTON_1 | BUTTON_2, BUTTON_1, 0])
+    check("other order plays only the combination", reports == expected(BUTTON_1 | BUTTON_2))
+
+    reports, _ = play([BUTTON_1, BUTTON_1, BUTTON_1 | BUTTON_2], release=False)
+    check("nothing plays while buttons are held", reports == b"")
+
+    reports, _ = play([BUTTON_1, 0, BUTTON_2, 0])
+    check("separate presses play separately", reports == expected(BUTTON_1, BUTTON_2))
+
+    reports, device = play([BUTTON_2, BUTTON_2 | BUTTON_3, BUTTON_3, 0])
+    check("profile chord plays nothing", reports == b"")
+    check("profile chord switches the profile", device.profile == 2)
+
+    reports, _ = play([BUTTON_2, BUTTON_2 | BUTTON_3, BUTTON_3, 0, BUTTON_2, 0])
+    check("macros play again after the chord", reports == expected(BUTTON_2))
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
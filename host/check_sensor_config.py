@@ -0,0 +1,112 @@
+# check_sensor_config.py
+# Checks sensor_config.py against the fake AS5600 register map in standins.py: every filter profile must land in
+# the right CONF bits without touching the output stage bits, ZPOS must hold the zero offset with MPOS and MANG
+# cleared, the angle must read 0 at the calibrated position, and CustomHid must compute the same rotations with
+# the offsets in the sensors as it does in software.
+#
+#   python host/check_sensor_config.py
+#
+# Prints one line per check and exits with 1 if any of them fail.
+import math
+import sys
+
+import standins
+
+standins.install()
+import sensor_config
+from sensor_config import FILTERS, SensorConfig, CONF, ZPOS, MPOS, MANG
+
+
+class FakeConfigurableSensor:
+    # The parts of SensorMonitor that CustomHid uses, on top of a FakeAS5600Bus
+
+    def __init__(self, raw_angle):
+        self.bus = standins.FakeAS5600Bus(raw_angle)
+
+    @property
+    def angle(self):
+        return sensor_config.read_register(self.bus, sensor_config.ANGLE)
+
+    def configure(self, zero_count, config):
+        sensor_config.configure(self.bus, zero_count, config)
+
+
+failures = []
+
+def check(name, condition):
+    print("{:60} {}".format(name, "ok" if condition else "FAILED"))
+    if not condition:
+        failures.append(name)
+
+
+def check_registers():
+    for name, config in sorted(FILTERS.items()):
+        bus = standins.FakeAS5600Bus(raw_angle=1234)
+        bus.registers[CONF + 1] = 0xB0 # Output stage and PWM frequency bits, must survive
+        bus.registers[MPOS], bus.registers[MPOS + 1] = 0x08, 0x00 # As if burned with a narrower range
+        sensor_config.configure(bus, 1000, config)
+        conf = sensor_config.read_register(bus, CONF)
+        check(name + ": slow filter", (conf >> 8) & 0x3 == config.slow_filter)
+        check(name + ": fast filter threshold", (conf >> 10) & 0x7 == config.fast_filter_threshold)
+        check(name + ": hysteresis", (conf >> 2) & 0x3 == config.hysteresis)
+        check(name + ": watchdog", (conf >> 13) & 0x1 == int(config.watchdog))
+        check(name + ": output stage kept", conf & 0xF0 == 0xB0)
+        check(name + ": ZPOS", sensor_config.read_register(bus, ZPOS) == 1000)
+        check(name + ": full range", sensor_config.read_register(bus, MPOS) == 0
+              and sensor_config.read_register(bus, MANG) == 0)
+        check(name + ": angle zeroed", sensor_config.read_register(bus, sensor_config.ANGLE) == 234)
+        check(name + ": bus unlocked", not bus.locked)
+
+    # A sensor that doesn't hold the values must be reported
+    bus = standins.FakeAS5600Bus()
+    # Drop writes to CONF like a broken chip would
+    bus.WRITABLE = {register: mask for register, mask in standins.FakeAS5600Bus.WRITABLE.items() if register < CONF}
+    try:
+        sensor_config.configure(bus, 0, SensorConfig(hysteresis=sensor_config.HYSTERESIS_3LSB))
+        check("read back mismatch raises", False)
+    except RuntimeError:
+        check("read back mismatch raises", True)
+
+
+def check_custom_hid():
+    # Same raw counts and offsets, once in software and once in the sensors
+    raw_counts = (3000, 100, 2048)
+    offsets = (0.5, 6.0, math.pi)
+
+    software, sensors, _, _ = standins.make_custom_hid(profile=1, keep_reports=False)
+    for sensor, count in zip(sensors, raw_counts):
+        sensor.angle = count
+    for joint, offset in enumerate(offsets):
+        software.offsets[joint] = offset
+
+    hardware_sensors = tuple(FakeConfigurableSensor(count) for count in raw_counts)
+    hardware, _, _, _ = standins.make_custom_hid(profile=1, keep_reports=False)
+    hardware.sensors = hardware_sensors
+    for joint, offset in enumerate(offsets):
+        hardware.offsets[joint] = offset
+    hardware.apply_sensor_config(FILTERS["balanced"])
+
+    step = 2 * math.pi / 4096 # The sensors round the offsets to whole counts
+    for _ in range(5):
+        expected = tuple(software.get_rotations())
+        actual = tuple(hardware.get_rotations())
+    check("custom_hid: rotations match software offsets", all(
+        abs((a - e + math.pi) % (2 * math.pi) - math.pi) <= step for a, e in zip(actual, expected)))
+
+    hardware.callibrate()
+    check("custom_hid: calibrate zeroes the angles", tuple(hardware.get_rotations()) == (0.0, 0.0, 0.0))
+    check("custom_hid: calibrate keeps absolute offsets", all(
+        abs(offset - count * step) <= step for offset, count in zip(hardware.offsets, raw_counts)))
+
+
+def main():
+    check_registers()
+    check_custom_hid()
+    if failures:
+        print("Failed:", ", ".join(failures))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
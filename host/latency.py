@@ -0,0 +1,137 @@
+# latency.py
+# Measures the pen's latency on real USB with an echo: the computer sends an echo command (CustomHid.COMMAND_ECHO)
+# with a stamp, the pen answers right after the reports of its next update with an echo report carrying the stamp
+# and its own timestamps (CustomHid.send_echo_report). From those this prints the distributions of:
+#   round trip     command written -> echo report read, on the computer's clock
+#   on device      command seen by the pen -> echo report sent, i.e. waiting for the next update and running it
+#   sample age     the update starting to read the sensors -> echo report sent
+#   one way        (round trip - on device) / 2, the USB and driver time per direction
+#   motion->report sample age + one way, from reading the sensors to the computer having the report
+# The one way times assume both directions take as long, like NTP does, since the two clocks can't be compared
+# directly. Command to pen includes waiting for the pen to poll for it, so the real pen to computer time is a bit
+# shorter than the estimate. Device times have the resolution of time.monotonic_ns() on the board.
+#
+#   python host/latency.py [--count 1000] [--interval 0.01] [--csv latency.csv] [--output after.json]
+#                          [--compare before.json]
+#
+# Keep the pen moving while measuring (or set a long idle_timeout in code.py): a parked pen updates less often
+# (power.py), which is measured too. --output saves the results, --compare shows the change against saved ones,
+# so a latency optimisation gets a before and after. Needs the hidapi bindings (pip install hidapi).
+import argparse
+import json
+import struct
+import sys
+import time
+
+from broadcaster import open_device, REPORT_ID
+
+COMMAND_ECHO = 0x04
+ECHO_REPORT_ID = 6
+ECHO_FORMAT = "<BIII" # stamp, sample time, command seen, report sent (us, device clock)
+WRAP = 0xFFFFFFFF
+
+METRICS = ("round_trip", "on_device", "sample_age", "one_way", "motion_to_report")
+
+
+def drain(device):
+    # Throw away the reports already queued, so the echo is read as soon as it arrives
+    while device.read(64, 1):
+        pass
+
+
+def ping(device, stamp, timeout):
+    """
+    Send one echo command and wait for its echo report. Returns a dict of the metrics in microseconds,
+    or None if no echo came back within timeout seconds.
+    """
+    sent = time.perf_counter_ns()
+    device.write(bytes((REPORT_ID, COMMAND_ECHO, stamp)))
+    deadline = sent + int(timeout * 1000000000)
+    while True:
+        remaining = (deadline - time.perf_counter_ns()) // 1000000
+        if remaining <= 0:
+            return None
+        report = device.read(64, remaining)
+        received = time.perf_counter_ns()
+        if len(report) > struct.calcsize(ECHO_FORMAT) and report[0] == ECHO_REPORT_ID and report[1] == stamp:
+            break
+    _, sample_time, seen, reported = struct.unpack_from(ECHO_FORMAT, bytes(report), 1)
+    round_trip = (received - sent) / 1000
+    on_device = (reported - seen) & WRAP
+    sample_age = (reported - sample_time) & WRAP
+    one_way = (round_trip - on_device) / 2
+    return {"round_trip": round_trip, "on_device": on_device, "sample_age": sample_age, "one_way": one_way,
+            "motion_to_report": sample_age + one_way}
+
+
+def summarize(values):
+    # Distribution of a list of values: min, percentiles, max and mean
+    ordered = sorted(values)
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {"min": ordered[0], "p50": percentile(0.5), "p90": percentile(0.9), "p99": percentile(0.99),
+            "max": ordered[-1], "mean": sum(ordered) / len(ordered)}
+
+
+def print_summary(summary, baseline=None):
+    print("{:18} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}  (us)".format("", "min", "p50", "p90", "p99", "max", "mean"))
+    for metric in METRICS:
+        stats = summary[metric]
+        line = "{:18} {min:9.1f} {p50:9.1f} {p90:9.1f} {p99:9.1f} {max:9.1f} {mean:9.1f}".format(metric, **stats)
+        if baseline and metric in baseline:
+            base = baseline[metric]
+            line += "  p50 {:+.1f}, p99 {:+.1f}".format(stats["p50"] - base["p50"], stats["p99"] - base["p99"])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the Mobi3-Pen's USB report latency with echo reports")
+    parser.add_argument("--count", type=int, default=1000, help="Echoes to send (default 1000)")
+    parser.add_argument("--interval", type=float, default=0.01, help="Seconds between echoes (default 0.01)")
+    parser.add_argument("--timeout", type=float, default=0.5, help="Seconds to wait for an echo before counting it lost")
+    parser.add_argument("--csv", help="Write every measurement to this CSV file")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--compare", help="Show the change against results saved with --output")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["summary"]
+
+    device = open_device()
+    samples = []
+    lost = 0
+    try:
+        for i in range(args.count):
+            drain(device)
+            result = ping(device, i & 0xFF, args.timeout)
+            if result is None:
+                lost += 1
+            else:
+                samples.append(result)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        device.close()
+
+    print("echoes: {} lost: {}".format(len(samples), lost))
+    if not samples:
+        return 1
+    summary = {metric: summarize([sample[metric] for sample in samples]) for metric in METRICS}
+    print_summary(summary, baseline)
+
+    if args.csv:
+        with open(args.csv, "w") as f:
+            f.write(",".join(METRICS) + "\n")
+            for sample in samples:
+                f.write(",".join("{:.1f}".format(sample[metric]) for metric in METRICS) + "\n")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"count": len(samples), "lost": lost, "summary": summary}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,454 @@
+# npy_dataset.py
+# Converts captures into a dataset of NumPy column files, so long sessions can be analysed without parsing them
+# record by record. Each column is stored in chunks of plain .npy files that are memory-mapped when read, so
+# opening a dataset and slicing a time range out of it only touches the chunks in that range.
+#
+#   python host/npy_dataset.py capture.bin dataset [--append] [--offsets 0.1,0.2,0.3] [--chunk-rows 1048576]
+#   python host/npy_dataset.py --info dataset
+#
+# Captures can be recordings made with recorder.py or dumps of the binary sample stream (stream.py), e.g. saved
+# from the data port with cat /dev/ttyACM1 > stream.bin. The format is told apart by the recording's magic.
+# Custom HID reports can't be converted, they carry neither timestamps nor raw counts.
+#
+# Layout of a dataset directory:
+#   meta.json                The columns, the chunks (rows and first/last timestamp of each) and the sources
+#   chunk_000000/time.npy    int64    microseconds, unwrapped, increasing across appended captures
+#               /raw.npy     uint16   (rows, 3) raw sensor counts (arm1, arm2, turntable)
+#               /position.npy float32 (rows, 3) x, y, z in mm
+#               /buttons.npy uint8    button bitmask (CustomHid.read_buttons)
+#               /profile.npy uint8    active profile, 255 if the capture doesn't have it
+#   chunk_000001/...
+#
+# Recordings have no positions, they are worked out from the raw counts with the arm geometry in settings.toml
+# (KinematicChain) and --offsets, without the firmware's moving average. Stream dumps have the positions the pen
+# sent. When appending, the new capture's timestamps are shifted to continue after the last row, the shift is
+# kept in meta.json with the source. From Python:
+#
+#   from npy_dataset import Dataset
+#   data = Dataset("dataset")
+#   window = data.slice(60000000, 65000000) # Columns between 60 s and 65 s, as memory-mapped views if possible
+#
+# Needs NumPy (pip install numpy).
+import argparse
+import json
+import math
+import os
+import struct
+import sys
+
+import standins
+
+try:
+    import numpy as np
+except ImportError:
+    raise SystemExit("The numpy package is needed for datasets: pip install numpy")
+
+standins.install()
+import recorder
+import stream
+
+META_VERSION = 1
+DEFAULT_CHUNK_ROWS = 1 << 20 # About 20 MB of columns per chunk
+UNKNOWN_PROFILE = 255
+READ_BLOCK = 1 << 25 # Bytes of a stream dump decoded at a time
+
+# name: (dtype, values per row)
+COLUMNS = {
+    "time": ("<i8", 1),
+    "raw": ("<u2", 3),
+    "position": ("<f4", 3),
+    "buttons": ("u1", 1),
+    "profile": ("u1", 1),
+}
+
+# The captures' binary layouts as NumPy record types
+RECORD_DTYPE = np.dtype([("time", "<u4"), ("raw", "<u2", 3), ("buttons", "u1")])
+SAMPLE_DTYPE = np.dtype([("sequence", "<u2"), ("time", "<u4"), ("position", "<f4", 3), ("raw", "<u2", 3),
+                         ("buttons", "u1"), ("profile", "u1"), ("crc", "<u2")])
+assert RECORD_DTYPE.itemsize == recorder.RECORD_SIZE and SAMPLE_DTYPE.itemsize == stream.FRAME_SIZE
+ENCODED_SIZE = stream.FRAME_SIZE + 1 # A COBS frame this short always has exactly one overhead byte
+CRC_TABLE = np.array(stream.CRC_TABLE, dtype=np.uint16)
+
+
+def empty_columns(rows=0):
+    return {name: np.zeros((rows, width) if width > 1 else rows, dtype) for name, (dtype, width) in COLUMNS.items()}
+
+
+# Captures
+
+class Unwrapper:
+    # Turns wrapping uint32 microsecond timestamps into increasing int64, across the blocks of a capture
+
+    def __init__(self):
+        self.last = None
+        self.wraps = 0
+
+    def unwrap(self, timestamps):
+        times = timestamps.astype(np.int64)
+        if not len(times):
+            return times
+        steps = np.empty(len(times), np.int64)
+        steps[0] = self.last is not None and times[0] < self.last
+        steps[1:] = times[1:] < times[:-1]
+        wraps = self.wraps + np.cumsum(steps)
+        self.last = times[-1]
+        self.wraps = int(wraps[-1])
+        return times + (wraps << 32)
+
+
+class Positions:
+    # Vectorised KinematicChain.determine_pos for the raw counts of a recording
+
+    def __init__(self, kinematics, offsets=None):
+        self.kinematics = kinematics
+        self.offsets = np.array(offsets if offsets is not None else (0.0,) * (kinematics.link_count + 1), np.float64)
+
+    def __call__(self, raw):
+        chain = self.kinematics
+        rotations = (raw * (2 * math.pi / 4096) - self.offsets) % (2 * math.pi)
+        angle = np.zeros(len(raw))
+        x2 = np.zeros(len(raw))
+        z2 = np.zeros(len(raw))
+        for i in range(chain.link_count):
+            angle += chain.link_signs[i] * rotations[:, i] + chain.link_offsets[i]
+            x2 += np.sin(angle) * chain.link_lengths[i]
+            z2 += np.cos(angle) * chain.link_lengths[i]
+        rotation3 = chain.turntable_sign * rotations[:, chain.link_count] + chain.turntable_offset
+        cos3 = np.cos(rotation3)
+        sin3 = np.sin(rotation3)
+        y2 = chain.base_offset
+        position = np.empty((len(raw), 3), np.float32)
+        position[:, 0] = x2 * cos3 - y2 * sin3
+        position[:, 1] = x2 * sin3 + y2 * cos3
+        position[:, 2] = z2
+        return position
+
+
+def read_recording(path, positions, block_rows=DEFAULT_CHUNK_ROWS):
+    # Yield the columns of a recorder.py log, block_rows at a time. The file is mapped, not read into memory.
+    header_size = struct.calcsize(recorder.HEADER_FORMAT)
+    with open(path, "rb") as f:
+        header = f.read(header_size)
+    if len(header) < header_size:
+        raise ValueError("{} is not a Mobi3-Pen recording".format(path))
+    magic, version, sensor_count = struct.unpack(recorder.HEADER_FORMAT, header)
+    if magic != recorder.MAGIC or version != recorder.VERSION or sensor_count != recorder.SENSOR_COUNT:
+        raise ValueError("{} is not a Mobi3-Pen recording".format(path))
+    rows = (os.path.getsize(path) - header_size) // RECORD_DTYPE.itemsize
+    if not rows:
+        return
+    records = np.memmap(path, RECORD_DTYPE, "r", header_size, (rows,))
+    unwrapper = Unwrapper()
+    for start in range(0, rows, block_rows):
+        block = records[start:start + block_rows]
+        columns = {
+            "time": unwrapper.unwrap(block["time"]),
+            "raw": np.array(block["raw"]),
+            "buttons": np.array(block["buttons"]),
+        }
+        columns["position"] = positions(columns["raw"])
+        columns["profile"] = np.full(len(block), UNKNOWN_PROFILE, np.uint8)
+        yield columns
+
+
+def decode_frames(frames):
+    """
+    COBS decode and CRC check a (frames, ENCODED_SIZE) uint8 array of encoded frames without their delimiters.
+    Returns the valid frames as a SAMPLE_DTYPE array.
+    """
+    count = len(frames)
+    decoded = frames[:, 1:].copy()
+    valid = np.ones(count, bool)
+    rows = np.arange(count)
+    # Follow the chain of code bytes in every frame at once. Each code byte but the first stands for a zero.
+    code_index = np.zeros(count, np.intp)
+    active = np.ones(count, bool)
+    while active.any():
+        code = frames[rows[active], code_index[active]].astype(np.intp)
+        valid[rows[active][code == 0]] = False
+        next_index = code_index[active] + np.maximum(code, 1)
+        inside = next_index < ENCODED_SIZE
+        decoded[rows[active][inside], next_index[inside] - 1] = 0
+        valid[rows[active][next_index > ENCODED_SIZE]] = False
+        code_index[active] = next_index
+        active[active] = inside & (code != 0)
+    decoded = decoded[valid]
+
+    crc = np.full(len(decoded), 0xFFFF, np.uint16)
+    for i in range(stream.SAMPLE_SIZE):
+        crc = ((crc << 8) & 0xFFFF) ^ CRC_TABLE[((crc >> 8) ^ decoded[:, i]) & 0xFF]
+    samples = decoded.view(SAMPLE_DTYPE).reshape(-1)
+    return samples[samples["crc"] == crc]
+
+
+def read_stream_dump(path, block_size=READ_BLOCK, counters=None):
+    """
+    Yield the columns of a dump of the binary sample stream, decoded block_size bytes at a time.
+    counters: Optional dict, gets the number of "frames", "bad_frames" and "lost" samples like StreamDecoder.
+    """
+    counters = counters if counters is not None else {}
+    counters.update(frames=0, bad_frames=0, lost=0)
+    unwrapper = Unwrapper()
+    last_sequence = None
+    carry = b""
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(block_size)
+            if not data:
+                if carry:
+                    counters["bad_frames"] += 1 # Cut off at the end of the dump
+                return
+            buffer = np.frombuffer(carry + data, np.uint8)
+            ends = np.flatnonzero(buffer == 0)
+            if not len(ends):
+                carry = buffer.tobytes()
+                continue
+            carry = buffer[ends[-1] + 1:].tobytes()
+            starts = np.concatenate(([0], ends[:-1] + 1))
+            lengths = ends - starts
+            sized = lengths == ENCODED_SIZE
+            counters["bad_frames"] += int(np.count_nonzero(~sized & (lengths > 0)))
+            samples = decode_frames(buffer[starts[sized, None] + np.arange(ENCODED_SIZE)])
+            counters["bad_frames"] += int(np.count_nonzero(sized)) - len(samples)
+            if not len(samples):
+                continue
+            counters["frames"] += len(samples)
+
+            sequences = samples["sequence"].astype(np.int64)
+            previous = np.empty_like(sequences)
+            previous[0] = sequences[0] - 1 if last_sequence is None else last_sequence
+            previous[1:] = sequences[:-1]
+            counters["lost"] += int(((sequences - previous - 1) & 0xFFFF).sum())
+            last_sequence = int(sequences[-1])
+            yield {
+                "time": unwrapper.unwrap(samples["time"]),
+                "raw": np.array(samples["raw"]),
+                "position": np.array(samples["position"]),
+                "buttons": np.array(samples["buttons"]),
+                "profile": np.array(samples["profile"]),
+            }
+
+
+def read_capture(path, positions, counters=None):
+    # Yield the columns of a recording or a stream dump, whichever path is
+    with open(path, "rb") as f:
+        magic = f.read(len(recorder.MAGIC))
+    if magic == recorder.MAGIC:
+        return read_recording(path, positions)
+    return read_stream_dump(path, counters=counters)
+
+
+# Datasets
+
+def chunk_name(index):
+    return "chunk_{:06d}".format(index)
+
+
+class DatasetWriter:
+    # Appends rows to a dataset, in chunks of chunk_rows. close() writes the last, partial chunk and meta.json.
+
+    def __init__(self, path, chunk_rows=DEFAULT_CHUNK_ROWS, append=False):
+        """
+        append: Add to the dataset at path instead of replacing it. Its partial last chunk is read back and
+                rewritten with the new rows.
+        """
+        self.path = path
+        self.pending = []
+        self.pending_rows = 0
+        self.meta = {"version": META_VERSION, "chunk_rows": chunk_rows, "columns": COLUMNS, "chunks": [], "sources": []}
+        meta_path = os.path.join(path, "meta.json")
+        if append and os.path.exists(meta_path):
+            self.meta = load_meta(path)
+            chunks = self.meta["chunks"]
+            if chunks and chunks[-1]["rows"] < self.meta["chunk_rows"]:
+                last = chunks.pop()
+                directory = os.path.join(path, last["name"])
+                self.pending.append({name: np.load(os.path.join(directory, name + ".npy")) for name in COLUMNS})
+                self.pending_rows = last["rows"]
+        else:
+            os.makedirs(path, exist_ok=True)
+            for name in os.listdir(path):
+                if name.startswith("chunk_"):
+                    for column in os.listdir(os.path.join(path, name)):
+                        os.remove(os.path.join(path, name, column))
+                    os.rmdir(os.path.join(path, name))
+        self.chunk_rows = self.meta["chunk_rows"]
+
+    @property
+    def rows(self):
+        return sum(chunk["rows"] for chunk in self.meta["chunks"]) + self.pending_rows
+
+    @property
+    def end(self):
+        # Timestamp of the last row, None while empty
+        if self.pending_rows:
+            return int(self.pending[-1]["time"][-1])
+        if self.meta["chunks"]:
+            return self.meta["chunks"][-1]["end"]
+        return None
+
+    def add_source(self, name, time_shift):
+        self.meta["sources"].append({"file": name, "first_row": self.rows, "rows": 0, "time_shift": time_shift})
+
+    def write(self, columns):
+        # columns: dict with an array per column, all with the same number of rows
+        rows = len(columns["time"])
+        if not rows:
+            return
+        if self.meta["sources"]:
+            self.meta["sources"][-1]["rows"] += rows
+        self.pending.append(columns)
+        self.pending_rows += rows
+        while self.pending_rows >= self.chunk_rows:
+            self._flush(self.chunk_rows)
+
+    def close(self):
+        if self.pending_rows:
+            self._flush(self.pending_rows)
+        meta_path = os.path.join(self.path, "meta.json")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(self.meta, f, indent=1)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def _flush(self, rows):
+        columns = {name: np.concatenate([block[name] for block in self.pending]) for name in COLUMNS}
+        rest = {name: values[rows:] for name, values in columns.items()}
+        self.pending = [rest] if len(rest["time"]) else []
+        self.pending_rows -= rows
+
+        name = chunk_name(len(self.meta["chunks"]))
+        directory = os.path.join(self.path, name)
+        os.makedirs(directory, exist_ok=True)
+        for column, values in columns.items():
+            # Written under another name and moved into place, so readers that have the old file mapped keep it
+            file_path = os.path.join(directory, column + ".npy")
+            with open(file_path + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(values[:rows], COLUMNS[column][0]))
+            os.replace(file_path + ".tmp", file_path)
+        times = columns["time"]
+        self.meta["chunks"].append({"name": name, "rows": rows, "start": int(times[0]), "end": int(times[rows - 1])})
+
+
+def load_meta(path):
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("version") != META_VERSION:
+        raise ValueError("{} is not a version {} Mobi3-Pen dataset".format(path, META_VERSION))
+    return meta
+
+
+class Dataset:
+    # Read side of a dataset. Nothing is loaded up front, chunks are memory-mapped when a slice reaches them.
+
+    def __init__(self, path):
+        self.path = path
+        self.meta = load_meta(path)
+        self.chunks = self.meta["chunks"]
+        self.columns = tuple(self.meta["columns"])
+        self.starts = np.array([chunk["start"] for chunk in self.chunks], np.int64)
+        self.ends = np.array([chunk["end"] for chunk in self.chunks], np.int64)
+        self._mapped = {}
+
+    def __len__(self):
+        return sum(chunk["rows"] for chunk in self.chunks)
+
+    @property
+    def start(self):
+        return int(self.starts[0]) if self.chunks else None
+
+    @property
+    def end(self):
+        return int(self.ends[-1]) if self.chunks else None
+
+    def column(self, index, name):
+        # One column of one chunk, memory-mapped read-only
+        key = (index, name)
+        if key not in self._mapped:
+            file_path = os.path.join(self.path, self.chunks[index]["name"], name + ".npy")
+            self._mapped[key] = np.load(file_path, mmap_mode="r")
+        return self._mapped[key]
+
+    def iter_slices(self, start=None, end=None, columns=None):
+        """
+        Yield the rows with start <= time < end (microseconds, None for no limit) one chunk at a time, as dicts of
+        memory-mapped views. Nothing is copied, so this works for ranges that don't fit in memory.
+        """
+        columns = columns or self.columns
+        first = 0 if start is None else int(np.searchsorted(self.ends, start, "left"))
+        last = len(self.chunks) if end is None else int(np.searchsorted(self.starts, end, "left"))
+        for index in range(first, last):
+            times = self.column(index, "time")
+            low = 0 if start is None else int(np.searchsorted(times, start, "left"))
+            high = len(times) if end is None else int(np.searchsorted(times, end, "left"))
+            if low < high:
+                yield {name: self.column(index, name)[low:high] for name in columns}
+
+    def slice(self, start=None, end=None, columns=None):
+        # The rows with start <= time < end as a dict of arrays. Views into the mapped file if they are all in one
+        # chunk, otherwise the chunks' parts are copied into one array per column.
+        columns = columns or self.columns
+        parts = list(self.iter_slices(start, end, columns))
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return {name: values[:0] for name, values in empty_columns().items() if name in columns}
+        return {name: np.concatenate([part[name] for part in parts]) for name in columns}
+
+    def records(self, start=None, end=None):
+        # (timestamp_us, raw_counts, buttons) like recorder.read_records, for host/replay.py
+        for part in self.iter_slices(start, end, ("time", "raw", "buttons")):
+            for timestamp, raw, buttons in zip(part["time"].tolist(), part["raw"].tolist(), part["buttons"].tolist()):
+                yield timestamp, tuple(raw), buttons
+
+
+def convert(capture, path, append=False, offsets=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Convert the capture file into the dataset at path, or add it to the end of the dataset if append is True.
+    Returns the DatasetWriter (for its rows) and the stream counters (empty for a recording).
+    """
+    from kinematics import KinematicChain
+    positions = Positions(KinematicChain.from_settings(), offsets)
+    writer = DatasetWriter(path, chunk_rows, append)
+    end = writer.end
+    counters = {}
+    shift = None
+    for columns in read_capture(capture, positions, counters):
+        if shift is None:
+            # Continue 1 us after the last row, so time keeps increasing across captures
+            shift = 0 if end is None else end + 1 - int(columns["time"][0])
+            writer.add_source(os.path.basename(capture), shift)
+        columns["time"] += shift
+        writer.write(columns)
+    writer.close()
+    return writer, counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert Mobi3-Pen captures into memory-mapped NumPy datasets")
+    parser.add_argument("capture", nargs="?", help="Recording (recorder.py) or sample stream dump (stream.py)")
+    parser.add_argument("dataset", help="Dataset directory")
+    parser.add_argument("--append", action="store_true", help="Add to the end of an existing dataset")
+    parser.add_argument("--offsets", help="Calibration offsets in radians for recordings: arm1,arm2,turntable")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="Rows per chunk of a new dataset")
+    parser.add_argument("--info", action="store_true", help="Only print what's in the dataset")
+    args = parser.parse_args()
+
+    if not args.info:
+        if not args.capture:
+            parser.error("a capture to convert is needed")
+        offsets = tuple(float(value) for value in args.offsets.split(",")) if args.offsets else None
+        writer, counters = convert(args.capture, args.dataset, args.append, offsets, args.chunk_rows)
+        if counters:
+            print("Frames:", counters["frames"], "bad:", counters["bad_frames"], "lost:", counters["lost"],
+                  file=sys.stderr)
+
+    dataset = Dataset(args.dataset)
+    print("rows: {} in {} chunks".format(len(dataset), len(dataset.chunks)))
+    if len(dataset):
+        print("time: {} to {} us ({:.1f} s)".format(dataset.start, dataset.end, (dataset.end - dataset.start) / 1e6))
+    for source in dataset.meta["sources"]:
+        print("source: {file}, {rows} rows from row {first_row}, time shifted by {time_shift} us".format(**source))
+
+
+if __name__ == "__main__":
+    main()
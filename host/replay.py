@@ -0,0 +1,121 @@
+# replay.py
+# Feeds a recording made with recorder.Recorder back through an unmodified CustomHid on a computer.
+# The firmware clock follows the recorded timestamps, so a replay is deterministic: the same recording and
+# settings always produce the same reports, and the digest printed at the end can be compared between runs
+# to catch regressions. The time per update is printed too, for comparing filters and kinematics on real motion.
+#
+#   python host/replay.py capture.bin [--profile 1] [--offsets 0.1,0.2,0.3] [--reports out.bin]
+#
+# A dataset made with npy_dataset.py can be replayed too, or just part of it: --start and --end (seconds) only
+# load the chunks in that range.
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import time
+
+import standins
+
+
+class ReplaySource:
+    # Steps fake sensors and buttons through the records of a recording
+
+    def __init__(self, records, sensors, buttons):
+        self.records = records
+        self.sensors = sensors
+        self.buttons = buttons
+        self.clock_ns = 0
+
+    def monotonic_ns(self):
+        return self.clock_ns
+
+    def __iter__(self):
+        for timestamp, raw_counts, button_bits in self.records:
+            self.clock_ns = timestamp * 1000
+            for sensor, count in zip(self.sensors, raw_counts):
+                sensor.angle = count
+            for i, button in enumerate(self.buttons):
+                button.value = not button_bits & (1 << i) # Pulled up, so pressed reads False
+            yield timestamp
+
+
+def replay(data, profile=1, offsets=None, quiet=True):
+    """
+    Replay a recording, given as its bytes or as (timestamp_us, raw_counts, buttons) records.
+    Returns (update count, fake HID devices, total nanoseconds spent in update()).
+    """
+    standins.install()
+    from recorder import read_records
+
+    records = read_records(data) if isinstance(data, (bytes, bytearray)) else data
+    source = ReplaySource(list(records), (), ())
+    real_monotonic_ns = time.monotonic_ns
+    time.monotonic_ns = source.monotonic_ns # The firmware (e.g. KalmanEstimator) sees recorded time
+    try:
+        device, sensors, buttons, devices = standins.make_custom_hid(profile=profile)
+        source.sensors = sensors
+        source.buttons = buttons
+        if offsets is not None:
+            for joint, offset in enumerate(offsets):
+                device.offsets[joint] = offset
+
+        updates = 0
+        elapsed = 0
+        output = io.StringIO() if quiet else None
+        with contextlib.redirect_stdout(output) if quiet else contextlib.nullcontext():
+            for _ in source:
+                start = time.perf_counter_ns()
+                device.update()
+                elapsed += time.perf_counter_ns() - start
+                updates += 1
+                if quiet:
+                    output.seek(0)
+                    output.truncate()
+    finally:
+        time.monotonic_ns = real_monotonic_ns
+    return updates, devices, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a Mobi3-Pen recording through CustomHid")
+    parser.add_argument("recording", help="Recording, or dataset directory (npy_dataset.py)")
+    parser.add_argument("--profile", type=int, default=1, help="Profile index from profiles.py (default 1, custom HID)")
+    parser.add_argument("--offsets", help="Calibration offsets in radians: arm1,arm2,turntable")
+    parser.add_argument("--reports", help="Write every report sent (all devices, in order per device) to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the firmware's print output")
+    parser.add_argument("--start", type=float, help="Start of the part of a dataset to replay, in seconds")
+    parser.add_argument("--end", type=float, help="End of the part of a dataset to replay, in seconds")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.recording):
+        from npy_dataset import Dataset
+        dataset = Dataset(args.recording)
+        start = None if args.start is None else dataset.start + int(args.start * 1000000)
+        end = None if args.end is None else dataset.start + int(args.end * 1000000)
+        data = dataset.records(start, end)
+    else:
+        with open(args.recording, "rb") as f:
+            data = f.read()
+    offsets = tuple(float(value) for value in args.offsets.split(",")) if args.offsets else None
+    updates, devices, elapsed = replay(data, args.profile, offsets, quiet=not args.verbose)
+
+    digest = hashlib.sha256()
+    for name, hid_device in zip(("mouse", "custom", "digitizer"), devices):
+        for report in hid_device.reports:
+            digest.update(report)
+        print("{}: {} reports".format(name, hid_device.report_count))
+    print("updates: {}".format(updates))
+    if updates:
+        print("update(): {:.1f} us average".format(elapsed / updates / 1000))
+    print("digest: {}".format(digest.hexdigest()))
+
+    if args.reports:
+        with open(args.reports, "wb") as f:
+            for hid_device in devices:
+                for report in hid_device.reports:
+                    f.write(report)
+
+
+if __name__ == "__main__":
+    main()
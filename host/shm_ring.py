@@ -0,0 +1,214 @@
+# shm_ring.py
+# Shared memory ring buffer for local tools that follow the pen. One host reader (broadcaster.py or
+# stream_reader.py with --ring) decodes every sample once and writes it into a memory-mapped file; any number of
+# consumers map the same file and copy each sample out of it once, the copy being what the CRC below is checked
+# on, without sockets and without a system call per sample. RingReader below is the consumer side: read() returns
+# Records, read_into() copies the next record into a buffer the caller reuses and allocates nothing else per
+# sample. Run this file to print the samples as they arrive:
+#
+#   python host/shm_ring.py [--path /dev/shm/mobi3-pen.ring] [--oldest]
+#
+# Layout (little-endian, fixed, so consumers in other languages can map it too):
+#   Header, 64 bytes:
+#     0  char[4]  magic "M3RB"
+#     4  uint16   version (3)
+#     6  uint16   record size (48)
+#     8  uint32   capacity, in records
+#     16 uint64   records written so far (the newest record's sequence number)
+#   Then capacity records of 48 bytes. Record n (counting from 1) is at 64 + ((n - 1) % capacity) * 48:
+#     0  uint64   sequence number n
+#     8  float64  host receive time, time.time()
+#     16 uint32   device timestamp in microseconds (wraps), 0 if the source has none
+#     20 float32  x, y, z: what they hold depends on kind
+#     32 uint16   raw sensor counts (arm1, arm2, turntable), 0 if the source has none
+#     38 int8     delta x, delta y, delta z
+#     41 uint8    buttons
+#     42 uint8    profile, 255 if unknown
+#     43 uint8    kind: 0 (KIND_POSITION) x, y, z are the pen tip in mm (stream_reader.py),
+#                       1 (KIND_ROTATIONS) they are the joint rotations arm1, arm2, turntable in radians, the
+#                       floats of the custom HID report (broadcaster.py)
+#     44 uint32   CRC-32 (zlib.crc32) of bytes 0-43
+#
+# There is a single writer and no lock. The writer writes a record, then the header count. A reader copies a
+# record once and takes it only if the copy has the sequence number it expects and a matching CRC (the CRC-32 of
+# all 48 bytes of an intact record is always CRC_RESIDUE, so the copy is checked without slicing it), so a record
+# caught half written (or being overwritten) is never returned torn. None of this depends on the order in which
+# the stores become visible to other processes, so it holds on ARM (Apple Silicon, Raspberry Pi) as well as x86:
+# a record the count announces but that isn't complete yet is simply read again on the next call.
+import argparse
+import collections
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+MAGIC = b"M3RB"
+VERSION = 3
+HEADER_FORMAT = "<4sHHI4xQ"
+HEADER_SIZE = 64
+COUNT_OFFSET = 16
+RECORD_FORMAT = "<QdIfffHHHbbbBBBI"
+RECORD = struct.Struct(RECORD_FORMAT)
+RECORD_SIZE = RECORD.size
+CHECKED_SIZE = RECORD_SIZE - 4 # Everything but the CRC
+CRC_RESIDUE = 0x2144DF1C # zlib.crc32() of a whole record whose CRC matches
+UNKNOWN_PROFILE = 255
+KIND_POSITION = 0
+KIND_ROTATIONS = 1
+
+DEFAULT_PATH = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "mobi3-pen.ring")
+
+Record = collections.namedtuple("Record", ("sequence", "host_time", "device_time", "x", "y", "z",
+                                           "raw_1", "raw_2", "raw_3", "dx", "dy", "dz", "buttons", "profile", "kind"))
+
+
+class RingWriter:
+
+    def __init__(self, path=DEFAULT_PATH, capacity=4096):
+        """
+        Create the ring file, or take over an existing one. capacity: records kept, 4096 is several seconds at
+        full rate. An existing file isn't truncated, since readers that still have it mapped would crash, only
+        resized if its size is wrong. Its records are cleared and the count restarts from 0.
+        """
+        self.path = path
+        self.capacity = capacity
+        size = HEADER_SIZE + capacity * RECORD_SIZE
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        struct.pack_into(HEADER_FORMAT, self.map, 0, MAGIC, VERSION, RECORD_SIZE, capacity, 0)
+        self.map[HEADER_SIZE:] = bytes(size - HEADER_SIZE) # Sequence 0 never matches, so readers skip them
+        self.record = bytearray(RECORD_SIZE)
+        self.count = 0
+
+    def write(self, host_time, device_time, x, y, z, raw_1=0, raw_2=0, raw_3=0,
+              dx=0, dy=0, dz=0, buttons=0, profile=UNKNOWN_PROFILE, kind=KIND_POSITION):
+        sequence = self.count + 1
+        record = self.record
+        struct.pack_into(RECORD_FORMAT, record, 0, sequence, host_time, device_time, x, y, z,
+                         raw_1, raw_2, raw_3, dx, dy, dz, buttons, profile, kind, 0)
+        struct.pack_into("<I", record, CHECKED_SIZE, zlib.crc32(memoryview(record)[:CHECKED_SIZE]))
+        offset = HEADER_SIZE + self.count % self.capacity * RECORD_SIZE
+        self.map[offset:offset + RECORD_SIZE] = record
+        # One 8 byte copy: pack_into would zero the count before writing it, and a reader could see that 0
+        self.map[COUNT_OFFSET:COUNT_OFFSET + 8] = sequence.to_bytes(8, "little")
+        self.count = sequence
+
+    def close(self):
+        self.map.close()
+
+
+class RingReader:
+
+    def __init__(self, path=DEFAULT_PATH, oldest=False):
+        """
+        Map an existing ring. Reading starts with the samples written from now on, or with the oldest one still
+        in the ring if oldest is True.
+        """
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.capacity, count = struct.unpack_from(HEADER_FORMAT, self.map, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+            raise ValueError("{} is not a version {} Mobi3-Pen ring".format(path, VERSION))
+        self.view = memoryview(self.map) # Sliced without copying the record twice
+        self.buffer = bytearray(RECORD_SIZE) # Copy of the record being checked, for read() and latest()
+        self.cursor = max(0, count - self.capacity) if oldest else count # Sequence number of the last record read
+        self.lost = 0 # Records overwritten before they were read
+
+    def count(self):
+        # Records written so far. Read until two reads agree, in case the 8 bytes aren't stored at once.
+        count = struct.unpack_from("<Q", self.map, COUNT_OFFSET)[0]
+        while True:
+            again = struct.unpack_from("<Q", self.map, COUNT_OFFSET)[0]
+            if again == count:
+                return count
+            count = again
+
+    def read(self, limit=None):
+        # Return the records written since the last call (at most limit), oldest first
+        count = self.count()
+        buffer = self.buffer
+        records = []
+        while limit is None or len(records) < limit:
+            if not self._next(buffer, count):
+                break
+            records.append(Record._make(RECORD.unpack(buffer)[:-1]))
+        return records
+
+    def read_into(self, buffer):
+        """
+        Copy the next record into buffer and return its sequence number, or 0 if there is no new complete record.
+        buffer: writable, RECORD_SIZE bytes, e.g. one bytearray reused for every call. Take the fields out of it
+        with RECORD.unpack_from(buffer), or only the ones needed with struct.unpack_from at their offsets.
+        """
+        return self._next(buffer, self.count())
+
+    def latest(self):
+        # The newest record, or None if there is none yet. Doesn't move the read position.
+        count = self.count()
+        while count:
+            if self._copy(count, self.buffer):
+                return Record._make(RECORD.unpack(self.buffer)[:-1])
+            count = self.count() # Overwritten or not complete yet while reading, try again
+        return None
+
+    def _next(self, buffer, count):
+        # Copy the first record after the cursor, up to sequence count, into buffer. Returns its sequence or 0.
+        if count < self.cursor:
+            self.cursor = 0 # The writer was restarted
+        if count - self.cursor > self.capacity:
+            self.lost += count - self.cursor - self.capacity
+            self.cursor = count - self.capacity
+        while self.cursor < count:
+            sequence = self.cursor + 1
+            if self._copy(sequence, buffer):
+                self.cursor = sequence
+                return sequence
+            if self.count() - sequence < self.capacity:
+                return 0 # Announced but not complete yet, read it on the next call
+            self.lost += 1 # Overwritten
+            self.cursor = sequence
+        return 0
+
+    def _copy(self, sequence, buffer):
+        # Copy the slot of this sequence number into buffer. True if it holds that record, and not a torn copy.
+        offset = HEADER_SIZE + (sequence - 1) % self.capacity * RECORD_SIZE
+        buffer[:] = self.view[offset:offset + RECORD_SIZE] # One copy, checked as a whole
+        return zlib.crc32(buffer) == CRC_RESIDUE and struct.unpack_from("<Q", buffer)[0] == sequence
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the samples published to a Mobi3-Pen shared memory ring")
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    parser.add_argument("--oldest", action="store_true", help="Start with the oldest sample still in the ring")
+    args = parser.parse_args()
+
+    reader = RingReader(args.path, oldest=args.oldest)
+    try:
+        while True:
+            records = reader.read()
+            for record in records:
+                print("{} {:.6f} {:.3f} {:.3f} {:.3f} {} {}".format(
+                    record.sequence, record.host_time, record.x, record.y, record.z,
+                    "rad" if record.kind == KIND_ROTATIONS else "mm", record.buttons))
+            if not records:
+                time.sleep(0.001)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Lost:", reader.lost, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
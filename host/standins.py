@@ -0,0 +1,143 @@
+# standins.py
+# Stand-ins for the CircuitPython hardware modules used by the firmware, so CustomHid can run unmodified on a
+# computer (replaying recordings, benchmarking). Call install() before importing any firmware module.
+import os
+import sys
+import types
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeHidDevice:
+    # Looks like a usb_hid.Device to adafruit_hid and CustomHid
+
+    def __init__(self, usage_page, usage, keep_reports=True):
+        self.usage_page = usage_page
+        self.usage = usage
+        self.keep_reports = keep_reports
+        self.reports = []
+        self.report_count = 0
+        self.received = [] # Output reports queued for get_last_received_report()
+
+    def send_report(self, report, report_id=None):
+        self.report_count += 1
+        if self.keep_reports:
+            self.reports.append(bytes(report))
+
+    def get_last_received_report(self, report_id=None):
+        if self.received:
+            return self.received.pop(0)
+        return None
+
+
+class FakeButton:
+    # digitalio.DigitalInOut with a pull up: value is False while pressed
+    def __init__(self):
+        self.value = True
+
+
+class FakeSensor:
+    # AS5600 reporting a fixed raw count until changed
+    def __init__(self, angle=0):
+        self.angle = angle
+
+
+class FakeAS5600Bus:
+    # busio.I2C with an AS5600 on it, modelled down to the register map: the volatile configuration registers
+    # keep only their writable bits and ANGLE is RAW_ANGLE minus ZPOS (full range). Set raw_angle to move the magnet.
+    ADDRESS = 0x36
+    WRITABLE = {0x01: 0x0F, 0x02: 0xFF, 0x03: 0x0F, 0x04: 0xFF, 0x05: 0x0F, 0x06: 0xFF, 0x07: 0x3F, 0x08: 0xFF}
+
+    def __init__(self, raw_angle=0):
+        self.registers = bytearray(256)
+        self.raw_angle = raw_angle
+        self.pointer = 0
+        self.locked = False
+        self.writes = 0
+
+    def try_lock(self):
+        if self.locked:
+            return False
+        self.locked = True
+        return True
+
+    def unlock(self):
+        self.locked = False
+
+    def _check(self, address):
+        assert self.locked, "bus used without try_lock()"
+        if address != self.ADDRESS:
+            raise OSError(19, "No device at address 0x{:02X}".format(address))
+
+    def writeto(self, address, buffer):
+        self._check(address)
+        self.pointer = buffer[0]
+        for i, value in enumerate(buffer[1:]):
+            register = self.pointer + i
+            if register in self.WRITABLE:
+                self.registers[register] = value & self.WRITABLE[register]
+                self.writes += 1
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in):
+        self._check(address)
+        self.pointer = buffer_out[0]
+        registers = self.registers
+        zero = (registers[0x01] << 8) | registers[0x02]
+        raw = self.raw_angle & 0xFFF
+        registers[0x0C], registers[0x0D] = raw >> 8, raw & 0xFF
+        angle = (raw - zero) & 0xFFF
+        registers[0x0E], registers[0x0F] = angle >> 8, angle & 0xFF
+        for i in range(len(buffer_in)):
+            buffer_in[i] = registers[(self.pointer + i) & 0xFF]
+
+
+def install():
+    if REPO not in sys.path:
+        sys.path.insert(0, REPO)
+        sys.path.insert(1, os.path.join(REPO, "lib"))
+
+    if "microcontroller" not in sys.modules:
+        microcontroller = types.ModuleType("microcontroller")
+        microcontroller.nvm = bytearray(b"\xff" * 4096) # Erased flash
+        sys.modules["microcontroller"] = microcontroller
+
+    if "micropython" not in sys.modules:
+        micropython = types.ModuleType("micropython")
+        micropython.const = lambda value: value
+        sys.modules["micropython"] = micropython
+
+    if "usb_hid" not in sys.modules:
+        usb_hid = types.ModuleType("usb_hid")
+        # Not FakeHidDevice's base: adafruit_hid.find_device only waits for USB on real usb_hid.Device objects
+        usb_hid.Device = type("Device", (), {})
+        usb_hid.devices = []
+        sys.modules["usb_hid"] = usb_hid
+
+
+def make_devices(keep_reports=True):
+    # mouse, custom HID and digitizer devices matching boot.py
+    return (FakeHidDevice(0x01, 0x02, keep_reports),
+            FakeHidDevice(0xFF00, 0x01, keep_reports),
+            FakeHidDevice(0x0D, 0x02, keep_reports))
+
+
+def make_custom_hid(profile=1, keep_reports=True, **kwargs):
+    """
+    Build a CustomHid wired to fake sensors, buttons and HID devices.
+    Returns (device, sensors, buttons, (mouse_device, custom_device, digitizer_device)).
+    """
+    install()
+    from adafruit_hid.mouse import Mouse
+    from custom_hid import CustomHid
+    from digitizer import Digitizer
+
+    mouse_device, custom_device, digitizer_device = make_devices(keep_reports)
+    sensors = (FakeSensor(), FakeSensor(), FakeSensor())
+    buttons = (FakeButton(), FakeButton(), FakeButton())
+    device = CustomHid(Mouse(mouse_device), custom_device,
+                       sensors[0], sensors[1], sensors[2],
+                       buttons[0], buttons[1], buttons[2],
+                       profile=profile,
+                       digitizer=Digitizer(digitizer_device),
+                       **kwargs)
+    return device, sensors, buttons, (mouse_device, custom_device, digitizer_device)
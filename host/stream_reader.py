@@ -0,0 +1,119 @@
+# stream_reader.py
+# Reads the binary sample stream (stream.py) from the pen's second USB serial port. Enable it with
+# MOBI3_SAMPLE_STREAM = 1 in settings.toml. Frames with a bad CRC are dropped and gaps in the sequence numbers
+# are counted, so you know how many samples were lost.
+#
+#   python host/stream_reader.py [--port /dev/ttyACM1] [--csv samples.csv] [--ring [PATH]] [--quiet]
+#
+# With --ring the samples are also written to a shared memory ring (shm_ring.py) for other local tools.
+#
+# Needs pyserial (pip install pyserial).
+import argparse
+import struct
+import sys
+import time
+
+import shm_ring
+import standins
+
+standins.install()
+from stream import SAMPLE_FORMAT, SAMPLE_SIZE, FRAME_SIZE, crc16, cobs_decode
+
+VID = 0x239A
+PID = 0x80F4
+
+
+class StreamDecoder:
+    # Splits the incoming bytes into frames and decodes them. Usable with any byte source, not only a serial port.
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.last_sequence = None
+        self.frames = 0
+        self.bad_frames = 0 # Wrong size, bad COBS or bad CRC
+        self.lost = 0 # Missing sequence numbers
+
+    def feed(self, data):
+        """
+        Add received bytes and return the samples completed by them, as tuples:
+        (sequence, timestamp_us, x, y, z, raw_1, raw_2, raw_3, buttons, profile)
+        """
+        self.buffer += data
+        samples = []
+        while True:
+            end = self.buffer.find(0)
+            if end < 0:
+                return samples
+            frame = bytes(self.buffer[:end])
+            del self.buffer[:end + 1]
+            if not frame:
+                continue
+            try:
+                decoded = cobs_decode(frame)
+            except ValueError:
+                self.bad_frames += 1
+                continue
+            if len(decoded) != FRAME_SIZE or \
+                    crc16(decoded, SAMPLE_SIZE) != struct.unpack_from("<H", decoded, SAMPLE_SIZE)[0]:
+                self.bad_frames += 1
+                continue
+
+            sample = struct.unpack_from(SAMPLE_FORMAT, decoded)
+            sequence = sample[0]
+            if self.last_sequence is not None:
+                self.lost += (sequence - self.last_sequence - 1) & 0xFFFF
+            self.last_sequence = sequence
+            self.frames += 1
+            samples.append(sample)
+
+
+def find_port():
+    # The pen's data channel is the last of its serial ports (the first is the REPL console)
+    from serial.tools import list_ports
+    ports = sorted(port.device for port in list_ports.comports() if port.vid == VID and port.pid == PID)
+    if len(ports) < 2:
+        raise SystemExit("No Mobi3-Pen data port found, is MOBI3_SAMPLE_STREAM = 1 in settings.toml? Use --port")
+    return ports[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read the Mobi3-Pen's binary sample stream")
+    parser.add_argument("--port", help="Serial port of the data channel, found automatically if not given")
+    parser.add_argument("--csv", help="Write the samples to this CSV file")
+    parser.add_argument("--ring", nargs="?", const=shm_ring.DEFAULT_PATH, help="Also publish to a shared memory ring")
+    parser.add_argument("--quiet", action="store_true", help="Only print the frame counters")
+    args = parser.parse_args()
+
+    try:
+        import serial
+    except ImportError:
+        raise SystemExit("The pyserial package is needed to read the stream: pip install pyserial")
+    port = serial.Serial(args.port or find_port(), timeout=0.1) # The baud rate doesn't matter over USB
+    csv = open(args.csv, "w") if args.csv else None
+    if csv:
+        csv.write("sequence,timestamp_us,x,y,z,raw_1,raw_2,raw_3,buttons,profile\n")
+
+    ring = shm_ring.RingWriter(args.ring) if args.ring else None
+
+    decoder = StreamDecoder()
+    try:
+        while True:
+            for sample in decoder.feed(port.read(port.in_waiting or 1)):
+                if ring:
+                    _, timestamp, x, y, z, raw_1, raw_2, raw_3, buttons, profile = sample
+                    ring.write(time.time(), timestamp, x, y, z, raw_1, raw_2, raw_3, buttons=buttons, profile=profile)
+                line = "{},{},{:.3f},{:.3f},{:.3f},{},{},{},{},{}".format(*sample)
+                if csv:
+                    csv.write(line + "\n")
+                if not args.quiet:
+                    print(line)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if csv:
+            csv.close()
+        print("Frames:", decoder.frames, "bad:", decoder.bad_frames, "lost:", decoder.lost, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# kalman.py
+# Constant-velocity Kalman filter over the 3D pen position from ArmKinematics.determine_pos.
+# Each axis is an independent [position, velocity] filter, which is what the full 6-state filter reduces
+# to when the noise on the axes is uncorrelated. All state lives in preallocated arrays so a step
+# allocates nothing.
+#
+# The filter can also report the position predicted lead_time seconds ahead, to make up for the lag of the
+# smoothing, the sequential sensor reads and USB polling.
+import time
+from array import array
+
+class KalmanEstimator:
+
+    def __init__(self, process_noise=5000.0, measurement_noise=0.05, lead_time=0.0):
+        """
+        process_noise: Spectral density of the (unknown) acceleration in (mm/s^2)^2/Hz. Higher follows
+                       fast motion more closely, lower smooths more.
+        measurement_noise: Variance of a measured position in mm^2.
+        lead_time: Seconds to predict ahead in the output. 0 returns the filtered position.
+        """
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.lead_time = lead_time
+
+        self.position = array("f", (0.0, 0.0, 0.0))
+        self.velocity = array("f", (0.0, 0.0, 0.0))
+        # Symmetric 2x2 covariance per axis: [p00, p01, p11] for x, then y, then z
+        self.covariance = array("f", (0.0,) * 9)
+        self.output = array("f", (0.0, 0.0, 0.0))
+        self._measured = array("f", (0.0, 0.0, 0.0))
+
+        self.last_time = None
+
+    def reset(self, x, y, z):
+        self.position[0] = x
+        self.position[1] = y
+        self.position[2] = z
+        for axis in range(3):
+            self.velocity[axis] = 0.0
+            self.output[axis] = self.position[axis]
+            c = axis * 3
+            self.covariance[c] = self.measurement_noise
+            self.covariance[c + 1] = 0.0
+            self.covariance[c + 2] = self.process_noise # Velocity is unknown to start with
+        self.last_time = time.monotonic_ns()
+
+    def update(self, x, y, z):
+        """
+        Add a measured position and return the estimate as an array of 3 floats (x, y, z).
+        The returned array is reused on the next update.
+        """
+        now = time.monotonic_ns()
+        if self.last_time is None:
+            self.reset(x, y, z)
+            return self.output
+        dt = (now - self.last_time) / 1e9
+        self.last_time = now
+        if dt <= 0:
+            return self.output
+
+        # Process noise for a constant velocity model driven by white acceleration
+        q = self.process_noise
+        q00 = q * dt * dt * dt / 3
+        q01 = q * dt * dt / 2
+        q11 = q * dt
+        r = self.measurement_noise
+        lead = self.lead_time
+
+        measured = self._measured
+        measured[0] = x
+        measured[1] = y
+        measured[2] = z
+        position = self.position
+        velocity = self.velocity
+        covariance = self.covariance
+        output = self.output
+        for axis in range(3):
+            c = axis * 3
+            p00 = covariance[c]
+            p01 = covariance[c + 1]
+            p11 = covariance[c + 2]
+
+            # Predict
+            predicted = position[axis] + velocity[axis] * dt
+            p00 = p00 + dt * (2 * p01 + dt * p11) + q00
+            p01 = p01 + dt * p11 + q01
+            p11 = p11 + q11
+
+            # Correct with the measured position
+            s = p00 + r
+            k0 = p00 / s
+            k1 = p01 / s
+            innovation = measured[axis] - predicted
+            position[axis] = predicted + k0 * innovation
+            velocity[axis] += k1 * innovation
+            covariance[c] = (1 - k0) * p00
+            covariance[c + 1] = (1 - k0) * p01
+            covariance[c + 2] = p11 - k1 * p01
+
+            output[axis] = position[axis] + velocity[axis] * lead
+
+        return output
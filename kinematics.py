@@ -1,4 +1,5 @@
 import math
+import os
 
 class ArmKinematics:
 
@@ -21,4 +22,110 @@ class ArmKinematics:
         # print(x3, y3, z3)
         # print(self.arm1_rotation_offset, self.arm2_rotation_offset, self.turntable_rotation_offset)
         
-        return (x3, y3, z3) 
+        return (x3, y3, z3)
+
+
+class KinematicChain:
+    """
+    A planar chain of links on a turntable, the general form of the arm in ArmKinematics.determine_pos.
+    Each link joint has a sign and an offset applied to its measured rotation, the turntable as well. The
+    link rotations add up along the chain. The per-link constants of the general loop, and whether the
+    arm can take the fast two-link path, are worked out once here.
+    """
+
+    # Used for anything missing from settings.toml
+    DEFAULT_LINK_LENGTHS = (170, 205) # Arm 1 (the shorter one) and arm 2 (the longer one) in mm
+    DEFAULT_BASE_OFFSET = (45+8+8+21) # The total y distance from the center of the platform to the center of the pen tip when the platform is facing the user
+
+    def __init__(self, link_lengths, base_offset, link_signs=None, link_offsets=None, turntable_sign=1, turntable_offset=0.0):
+        """
+        link_lengths: Length of each link in mm, from the base outwards.
+        base_offset: y distance from the turntable axis to the plane the links move in, in mm.
+        link_signs, link_offsets: Per link joint, the measured rotation becomes sign * rotation + offset (radians).
+        """
+        count = len(link_lengths)
+        self.link_count = count
+        self.link_lengths = tuple(float(length) for length in link_lengths)
+        self.link_signs = tuple(float(sign) for sign in (link_signs or (1,) * count))
+        self.link_offsets = tuple(float(offset) for offset in (link_offsets or (0.0,) * count))
+        self.base_offset = float(base_offset)
+        self.turntable_sign = float(turntable_sign)
+        self.turntable_offset = float(turntable_offset)
+
+        # What the general loop in determine_pos needs per link: its sign, the sum of the offsets up to and
+        # including it (the offsets add up along the chain like the rotations do) and its length
+        links = []
+        offset_sum = 0.0
+        for sign, offset, length in zip(self.link_signs, self.link_offsets, self.link_lengths):
+            offset_sum += offset
+            links.append((sign, offset_sum, length))
+        self._links = tuple(links)
+
+        # The default arm (two links, no signs or offsets) is the common case, so it gets a fast path
+        self._simple = count == 2 and self.link_signs == (1.0, 1.0) and self.link_offsets == (0.0, 0.0) \
+            and self.turntable_sign == 1.0 and self.turntable_offset == 0.0
+
+    @staticmethod
+    def _floats(value, default):
+        # settings.toml only holds strings and integers, so lists are comma separated strings
+        if value is None:
+            return default
+        if isinstance(value, str):
+            return tuple(float(part) for part in value.split(","))
+        return (float(value),)
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Load the arm geometry from settings.toml (angles in degrees):
+        MOBI3_LINK_LENGTHS = "170,205"
+        MOBI3_BASE_OFFSET = 82
+        MOBI3_LINK_SIGNS = "1,1"
+        MOBI3_LINK_OFFSETS = "0,0"
+        MOBI3_TURNTABLE_SIGN = 1
+        MOBI3_TURNTABLE_OFFSET = 0
+        """
+        link_lengths = cls._floats(os.getenv("MOBI3_LINK_LENGTHS"), cls.DEFAULT_LINK_LENGTHS)
+        count = len(link_lengths)
+        base_offset = cls._floats(os.getenv("MOBI3_BASE_OFFSET"), (cls.DEFAULT_BASE_OFFSET,))[0]
+        link_signs = cls._floats(os.getenv("MOBI3_LINK_SIGNS"), (1,) * count)
+        link_offsets = cls._floats(os.getenv("MOBI3_LINK_OFFSETS"), (0,) * count)
+        if len(link_signs) != count or len(link_offsets) != count:
+            raise ValueError("MOBI3_LINK_SIGNS and MOBI3_LINK_OFFSETS need one value per link")
+        turntable_sign = cls._floats(os.getenv("MOBI3_TURNTABLE_SIGN"), (1,))[0]
+        turntable_offset = cls._floats(os.getenv("MOBI3_TURNTABLE_OFFSET"), (0,))[0]
+        return cls(link_lengths, base_offset,
+                   link_signs, [math.radians(offset) for offset in link_offsets],
+                   turntable_sign, math.radians(turntable_offset))
+
+    def determine_pos(self, rotations):
+        """
+        rotations: One measured rotation per link joint followed by the turntable rotation, in radians,
+                   as returned by CustomHid.get_rotations().
+        Returns the pen tip position (x, y, z) in mm.
+        """
+        if self._simple:
+            rotation1 = rotations[0]
+            rotation12 = rotation1 + rotations[1]
+            length1, length2 = self.link_lengths
+            x2 = math.sin(rotation1) * length1 + math.sin(rotation12) * length2
+            z2 = math.cos(rotation1) * length1 + math.cos(rotation12) * length2
+            rotation3 = rotations[2]
+        else:
+            turn = 0.0 # Sum of the signed rotations so far
+            x2 = 0.0
+            z2 = 0.0
+            i = 0
+            for sign, offset_sum, length in self._links:
+                turn += sign * rotations[i]
+                angle = turn + offset_sum
+                x2 += math.sin(angle) * length
+                z2 += math.cos(angle) * length
+                i += 1
+            rotation3 = self.turntable_sign * rotations[self.link_count] + self.turntable_offset
+
+        # Apply the turntable rotation
+        y2 = self.base_offset
+        cos3 = math.cos(rotation3)
+        sin3 = math.sin(rotation3)
+        return (x2 * cos3 - y2 * sin3, x2 * sin3 + y2 * cos3, z2)
@@ -0,0 +1,113 @@
+# macros.py
+# Keyboard shortcuts and text macros for the pen buttons.
+# Each macro is compiled once, through KeyboardLayoutBase.keycodes, into one flat bytes object holding every
+# keyboard report it needs (press, release, press, ...). Playing it back is then a slice and a send_report
+# per tick, queued so a long macro never blocks the tracking loop the way layout.write() would.
+from adafruit_hid import find_device
+from adafruit_hid.keycode import Keycode
+
+class MacroEngine:
+
+    MAX_QUEUED = 8 # Macros triggered while this many are waiting are dropped
+
+    def __init__(self, devices, layout, bindings, nkro=False, timeout=None):
+        """
+        devices: usb_hid.devices, or the keyboard device itself.
+        layout: A keyboard layout such as KeyboardLayoutUS(None), only used to look up keycodes while compiling.
+        bindings: {button mask: macro}, with the button masks from CustomHid (BUTTON_1, ...). A macro is either
+                  a string of text to type, a tuple of keycodes pressed together (a shortcut), or a list of those
+                  played one after another, e.g. [(Keycode.CONTROL, Keycode.A), "hello"].
+        nkro: Build reports for the N-key-rollover keyboard (MOBI3_NKRO_KEYBOARD in settings.toml) instead of
+              the standard 6 key keyboard.
+        """
+        self._keyboard_device = find_device(devices, usage_page=0x1, usage=0x06, timeout=timeout)
+        self.layout = layout
+        self.nkro = nkro
+        if nkro:
+            from nkro_keyboard import NkroKeyboard
+            self.report_length = NkroKeyboard.REPORT_LENGTH
+            self._set_key = NkroKeyboard.set_key
+        else:
+            self.report_length = 8 # Boot keyboard report: modifiers, reserved, 6 keys
+
+        self.bindings = {}
+        self.mask = 0 # Every button that has a macro
+        for buttons, macro in bindings.items():
+            self.bindings[buttons] = self.compile(macro)
+            self.mask |= buttons
+
+        self.held = 0 # Largest combination of macro buttons held since they were last all released
+        self.cancelled = False # Set by cancel(), nothing plays for the current combination
+        self.queue = [] # memoryviews of compiled macros waiting to play
+        self.offset = 0 # Position in the macro at the front of the queue
+
+    def build_report(self, keycodes):
+        # One keyboard report with these keys held down
+        report = bytearray(self.report_length)
+        if self.nkro:
+            for keycode in keycodes:
+                self._set_key(report, keycode)
+            return report
+        slot = 2
+        for keycode in keycodes:
+            modifier = Keycode.modifier_bit(keycode)
+            if modifier:
+                report[0] |= modifier
+            elif slot < self.report_length:
+                report[slot] = keycode
+                slot += 1
+            else:
+                raise ValueError("More than 6 keys pressed at once")
+        return report
+
+    def compile(self, macro):
+        # Turn a macro into one bytes object of concatenated reports, each press followed by a release
+        release = bytes(self.report_length)
+        reports = bytearray()
+        if isinstance(macro, str):
+            for char in macro:
+                reports += self.build_report(self.layout.keycodes(char))
+                reports += release
+        elif isinstance(macro, tuple):
+            reports += self.build_report(macro)
+            reports += release
+        else:
+            for part in macro:
+                reports += self.compile(part)
+        return bytes(reports)
+
+    def trigger(self, buttons):
+        """
+        Call with the macro buttons (buttons & mask) whenever they change. A macro is queued once they are all
+        released, for the largest combination held since they were pressed, so the single buttons passed through
+        while pressing or releasing a combination don't play their own macros.
+        """
+        if buttons:
+            if buttons & self.held == self.held:
+                self.held = buttons # The combination grew (or a new one started)
+            return
+        held = self.held
+        self.held = 0
+        if self.cancelled:
+            self.cancelled = False
+            return
+        macro = self.bindings.get(held)
+        if macro is not None and len(self.queue) < self.MAX_QUEUED:
+            self.queue.append(memoryview(macro))
+
+    def cancel(self):
+        # Play nothing for the buttons held now, e.g. when they were used for something else
+        self.cancelled = True
+
+    def tick(self):
+        # Send the next report of the queued macros, at most one per call
+        if not self.queue:
+            return
+        macro = self.queue[0]
+        offset = self.offset
+        self._keyboard_device.send_report(macro[offset:offset + self.report_length])
+        offset += self.report_length
+        if offset >= len(macro):
+            self.queue.pop(0)
+            offset = 0
+        self.offset = offset
@@ -0,0 +1,72 @@
+# nkro_keyboard.py
+# N-key-rollover keyboard for NKRO_KEYBOARD_DESCRIPTOR in boot.py, with the same API as adafruit_hid.keyboard.Keyboard.
+# Every key has its own bit in the report, so any number of keys can be held and pressing or releasing a key
+# is a single bit operation instead of scanning and shifting the 6 key slots.
+from adafruit_hid import find_device
+from adafruit_hid.keycode import Keycode
+
+class NkroKeyboard:
+
+    LED_NUM_LOCK = 0x01
+    LED_CAPS_LOCK = 0x02
+    LED_SCROLL_LOCK = 0x04
+    LED_COMPOSE = 0x08
+
+    REPORT_LENGTH = 16 # Modifier byte followed by a 120 bit key bitmap
+    MAX_KEYCODE = 0x77 # Usage Maximum of the bitmap in the descriptor
+
+    def __init__(self, devices, timeout=None):
+        self._keyboard_device = find_device(devices, usage_page=0x1, usage=0x06, timeout=timeout)
+
+        # Reuse this bytearray to send keyboard reports.
+        # report[0] modifiers
+        # report[1:16] one bit per keycode 0x00-0x77, keycode k is bit (k & 7) of report[1 + (k >> 3)]
+        self.report = bytearray(self.REPORT_LENGTH)
+        self._led_status = b"\x00"
+
+    @classmethod
+    def set_key(cls, report, keycode, pressed=True):
+        # Set or clear one key (or modifier) in an NKRO report
+        modifier = Keycode.modifier_bit(keycode)
+        if modifier:
+            index = 0
+            bit = modifier
+        elif keycode <= cls.MAX_KEYCODE:
+            index = 1 + (keycode >> 3)
+            bit = 1 << (keycode & 7)
+        else:
+            raise ValueError("Keycode 0x{:02x} is not in the NKRO report".format(keycode))
+        if pressed:
+            report[index] |= bit
+        else:
+            report[index] &= ~bit
+
+    def press(self, *keycodes):
+        for keycode in keycodes:
+            self.set_key(self.report, keycode)
+        self._keyboard_device.send_report(self.report)
+
+    def release(self, *keycodes):
+        for keycode in keycodes:
+            self.set_key(self.report, keycode, False)
+        self._keyboard_device.send_report(self.report)
+
+    def release_all(self):
+        for i in range(self.REPORT_LENGTH):
+            self.report[i] = 0
+        self._keyboard_device.send_report(self.report)
+
+    def send(self, *keycodes):
+        self.press(*keycodes)
+        self.release_all()
+
+    @property
+    def led_status(self):
+        # get_last_received_report() returns None when nothing was received
+        led_report = self._keyboard_device.get_last_received_report()
+        if led_report is not None:
+            self._led_status = led_report
+        return self._led_status
+
+    def led_on(self, led_code):
+        return bool(self.led_status[0] & led_code)
@@ -0,0 +1,83 @@
+# oversampling.py
+# Reads each AS5600 several times per update and keeps the median, so a single bad I2C read (most often on the
+# bit-banged bus) is thrown away instead of being smeared over several positions by the moving average.
+# The number of reads adapts to the time left in the update period: the time the rest of update() takes is
+# measured every tick and the spare time is spent on extra reads, so oversampling never slows the report rate
+# below 1 / period.
+import time
+from array import array
+
+class Oversampler:
+
+    def __init__(self, sensors, period_us=8000, max_samples=5):
+        """
+        sensors: The rotation sensors (AS5600 or SensorMonitor), read in this order.
+        period_us: Target time per update. Extra reads only use what is left of it. The custom HID endpoint is
+                   polled every 8 ms by default, so reading faster than that only adds latency.
+        max_samples: Most reads per sensor per update.
+        """
+        self.sensors = tuple(sensors)
+        self.period = period_us * 1000
+        self.max_samples = max_samples
+        self.samples = 1 # Reads per sensor for the next update
+
+        # One row of max_samples reads per sensor, reused every update
+        self.buffer = array("H", [0] * (len(self.sensors) * max_samples))
+
+        self.last_start = 0
+        self.read_time = 0 # Time the reads took last update, in ns
+        self.round_time = 0 # Time to read every sensor once, in ns
+
+    def read(self, counts):
+        # Store the median raw count of each sensor in counts
+        start = time.monotonic_ns()
+        samples = self.samples
+        max_samples = self.max_samples
+        buffer = self.buffer
+        for sample in range(samples):
+            index = sample
+            for sensor in self.sensors:
+                buffer[index] = sensor.angle
+                index += max_samples
+        now = time.monotonic_ns()
+
+        # Spend the time the rest of the last update left over on reads, at least one round
+        round_time = (now - start) // samples
+        if self.last_start:
+            other_time = start - self.last_start - self.read_time
+            spare = self.period - other_time
+            if round_time > 0:
+                self.samples = max(1, min(max_samples, spare // round_time))
+        self.round_time = round_time
+        self.read_time = now - start
+        self.last_start = start
+
+        for i in range(len(self.sensors)):
+            counts[i] = self.median(buffer, i * max_samples, samples)
+
+    @staticmethod
+    def median(buffer, offset, length):
+        """
+        Median of buffer[offset:offset + length] for 12-bit angles. The row is sorted in place. Counts are taken
+        relative to the first one so readings on both sides of the 4095 -> 0 wrap stay next to each other.
+        """
+        if length == 1:
+            return buffer[offset]
+        reference = buffer[offset] - 2048
+        end = offset + length
+        for i in range(offset, end):
+            buffer[i] = (buffer[i] - reference) & 0xFFF
+        # Insertion sort, the rows are tiny
+        for i in range(offset + 1, end):
+            value = buffer[i]
+            j = i - 1
+            while j >= offset and buffer[j] > value:
+                buffer[j + 1] = buffer[j]
+                j -= 1
+            buffer[j + 1] = value
+        middle = offset + length // 2
+        if length & 1:
+            value = buffer[middle]
+        else:
+            value = (buffer[middle - 1] + buffer[middle]) // 2
+        return (value + reference) & 0xFFF
@@ -0,0 +1,208 @@
+# pipeline.py
+# The tracking loop as a chain of stages: sensor source -> rotation filter -> kinematics -> transforms (estimator,
+# drawing plane, accumulation), followed by the profile's sinks (sinks.py). Every stage reads and writes one
+# preallocated Sample instead of passing tuples along, so a stage can be swapped for a faster one, or benchmarked
+# on its own (see host/bench.py), without touching CustomHid. The Pipeline is built by CustomHid when a profile is
+# activated, and update() makes one bound call per stage.
+import math
+from array import array
+
+TWO_PI = 2 * math.pi
+COUNT_SCALE = TWO_PI / 4096 # Radians per AS5600 count
+
+class Sample:
+    # The buffer shared by the stages, allocated once
+
+    def __init__(self, joints=3):
+        self.counts = array("H", [0] * joints) # Raw 12-bit sensor counts, one per joint
+        self.rotations = array("f", [0] * joints) # Filtered joint rotations in radians
+        self.raw_position = array("f", (0, 0, 0)) # Pen tip from the kinematics (and estimator) in mm
+        self.position = array("f", (0, 0, 0)) # In the profile's coordinates (see PlaneStage)
+        self.deltas = array("f", (0, 0, 0)) # Movement since the last sample in mm
+        self.moves = array("i", (0, 0, 0)) # Whole report units to send
+
+
+class Pipeline:
+
+    def __init__(self, source, rotation_filter, kinematics, transforms=()):
+        self.source = source
+        self.rotation_filter = rotation_filter
+        self.kinematics = kinematics
+        self.transforms = tuple(transforms)
+        self.stages = tuple(stage.run for stage in (source, rotation_filter, kinematics) + self.transforms)
+
+    def run(self, sample):
+        for stage in self.stages:
+            stage(sample)
+
+
+# Sources
+
+class SensorSource:
+
+    def __init__(self, sensors, oversampler=None):
+        """
+        sensors: One AS5600 (or SensorMonitor) per joint.
+        oversampler: Optional oversampling.Oversampler, reads the same sensors several times and keeps the median.
+        """
+        self.sensors = tuple(sensors)
+        self.oversampler = oversampler
+
+    def run(self, sample):
+        counts = sample.counts
+        if self.oversampler is not None:
+            self.oversampler.read(counts) # Median of several reads, spikes don't reach the filter
+            return
+        for joint, sensor in enumerate(self.sensors):
+            counts[joint] = sensor.angle
+
+
+# Rotation filters
+
+class MovingAverageFilter:
+    # Subtracts the calibration offsets and averages each joint over the last smoothing samples
+    # (fewer right after it is created)
+
+    def __init__(self, offsets, smoothing=3):
+        """
+        offsets: array of calibration offsets in radians, one per joint. Read every sample, so it can be
+                 changed in place (CustomHid.callibrate).
+        """
+        self.offsets = offsets
+        self.smoothing = smoothing
+        self.history = array("f", [0] * (len(offsets) * smoothing)) # smoothing entries per joint
+        self.index = 0
+        self.count = 0
+
+    def run(self, sample):
+        counts = sample.counts
+        rotations = sample.rotations
+        offsets = self.offsets
+        history = self.history
+        smoothing = self.smoothing
+        index = self.index
+        if self.count < smoothing:
+            self.count += 1
+        count = self.count
+        self.index = (index + 1) % smoothing
+        row = 0
+        for joint in range(len(offsets)):
+            history[row + index] = (counts[joint] * COUNT_SCALE - offsets[joint]) % TWO_PI
+            total = 0.0
+            for i in range(row, row + count):
+                total += history[i]
+            rotations[joint] = total / count
+            row += smoothing
+
+
+class ScaleFilter:
+    # For sensors that already apply the offsets and the filtering (sensor_config.py): only scales the counts
+
+    def run(self, sample):
+        counts = sample.counts
+        rotations = sample.rotations
+        for joint in range(len(counts)):
+            rotations[joint] = counts[joint] * COUNT_SCALE
+
+
+# Kinematics
+
+class KinematicsStage:
+
+    def __init__(self, kinematics):
+        # kinematics: Anything with determine_pos(rotations) returning (x, y, z), e.g. kinematics.KinematicChain
+        self.determine_pos = kinematics.determine_pos
+
+    def run(self, sample):
+        x, y, z = self.determine_pos(sample.rotations)
+        raw_position = sample.raw_position
+        raw_position[0] = x
+        raw_position[1] = y
+        raw_position[2] = z
+
+
+# Transforms
+
+class EstimatorStage:
+
+    def __init__(self, estimator):
+        # estimator: kalman.KalmanEstimator, replaces the raw position with its estimate
+        self.estimator = estimator
+
+    def run(self, sample):
+        raw_position = sample.raw_position
+        x, y, z = self.estimator.update(raw_position[0], raw_position[1], raw_position[2])
+        raw_position[0] = x
+        raw_position[1] = y
+        raw_position[2] = z
+
+
+class PlaneStage:
+    # Keeps the drawing plane's pen_down and distance up to date and writes the position in the profile's coordinates
+
+    def __init__(self, drawing_plane, plane_coordinates=False):
+        """
+        plane_coordinates: Position on the drawing plane (u, v, distance) instead of the arm's x, y, z.
+        """
+        self.drawing_plane = drawing_plane
+        self.plane_coordinates = plane_coordinates
+
+    def run(self, sample):
+        x, y, z = sample.raw_position
+        self.drawing_plane.update(x, y, z)
+        if self.plane_coordinates:
+            x, y, z = self.drawing_plane.to_plane(x, y, z)
+        position = sample.position
+        position[0] = x
+        position[1] = y
+        position[2] = z
+
+
+class Accumulator:
+    # Turns the position into relative report units. Movement is added up and only whole units are sent, the
+    # fractions carry over to the next sample so slow movements aren't lost to rounding.
+
+    def __init__(self):
+        self.previous = array("f", (0, 0, 0)) # Position of the last sample
+        self.gains = array("f", (0, 0, 0)) # Report units per mm
+        self.accumulation = array("f", (0, 0, 0))
+        self.acceleration = None
+
+    def configure(self, sensitivity, acceleration=None):
+        # sensitivity: Report units per mm. acceleration: Optional acceleration.AccelerationCurve for x and y.
+        gains = self.gains
+        gains[0] = gains[1] = gains[2] = sensitivity
+        if acceleration is not None:
+            gains[0] *= acceleration.x_gain
+            gains[1] *= acceleration.y_gain
+        self.acceleration = acceleration
+
+    def rebase(self, position):
+        # Start from position, so a jump (e.g. changing coordinates) doesn't register as movement
+        previous = self.previous
+        previous[0] = position[0]
+        previous[1] = position[1]
+        previous[2] = position[2]
+
+    def run(self, sample):
+        position = sample.position
+        deltas = sample.deltas
+        moves = sample.moves
+        previous = self.previous
+        gains = self.gains
+        accumulation = self.accumulation
+        speed_gain = 1.0
+        if self.acceleration is not None:
+            speed_gain = self.acceleration.gain(position[0] - previous[0], position[1] - previous[1]) # Only for x and y
+        # TODO: implement threshold to take into account total distance
+        for axis in range(3):
+            value = position[axis]
+            delta = value - previous[axis]
+            previous[axis] = value
+            deltas[axis] = delta
+            if axis < 2:
+                delta *= speed_gain
+            total = accumulation[axis] + delta * gains[axis]
+            move = int(total)
+            accumulation[axis] = total - move
+            moves[axis] = move
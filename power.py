@@ -0,0 +1,121 @@
+# power.py
+# Idle detection for a parked pen. When update() sees no movement and no buttons for a while, the loop steps down
+# to a slower sample rate (and optionally a lower CPU clock), which also slows the I2C traffic and the reports.
+# The first tick that sees movement or a button goes straight back to full speed, so waking never takes longer
+# than one tick of the state the pen was in.
+# Every state change prints a line with the time spent in each state and the wake up counters, from wait() so the
+# serial output doesn't delay the reports of the tick that woke up.
+import time
+
+class PowerManager:
+
+    # States
+    ACTIVE = 0
+    IDLE = 1
+    SLEEP = 2
+    STATE_NAMES = ("active", "idle", "sleep")
+
+    def __init__(self, idle_timeout=5, sleep_timeout=60, idle_period_ms=20, sleep_period_ms=100,
+                 motion_threshold=1.0, sleep_frequency=None):
+        """
+        idle_timeout, sleep_timeout: Seconds without movement before entering IDLE and SLEEP.
+        idle_period_ms, sleep_period_ms: Time per update in those states. ACTIVE runs as fast as it can.
+        motion_threshold: Movement (mm, on any axis) that counts as moving. The update deltas are added up, so
+                          sensor jitter cancels out instead of keeping the pen awake.
+        sleep_frequency: CPU frequency (Hz) while in SLEEP, if the board supports changing it
+                         (microcontroller.cpu.frequency). None leaves the clock alone.
+        """
+        self.timeouts = (0, idle_timeout * 1000000000, sleep_timeout * 1000000000)
+        self.periods = (0, idle_period_ms * 1000000, sleep_period_ms * 1000000)
+        self.motion_threshold = motion_threshold
+
+        self.cpu = None
+        self.sleep_frequency = sleep_frequency
+        self.normal_frequency = None
+        if sleep_frequency:
+            try:
+                import microcontroller
+                self.cpu = microcontroller.cpu
+                self.normal_frequency = self.cpu.frequency
+            except (ImportError, AttributeError):
+                print("Power: CPU frequency can't be changed on this board")
+
+        now = time.monotonic_ns()
+        self.state = self.ACTIVE
+        self.state_since = now
+        self.tick_start = now
+        self.last_motion = now
+        self.last_buttons = 0
+        # Movement since the last motion, per axis
+        self.moved_x = 0.0
+        self.moved_y = 0.0
+        self.moved_z = 0.0
+
+        # Counters
+        self.state_time = [0, 0, 0] # ns spent in each state, not counting the current stay (see times())
+        self.wakeups = 0
+        # ns from the last tick that saw no motion to the tick that woke up, for the last wake up. The motion started
+        # somewhere in between, so this is the longest it can have waited to be seen (one tick of IDLE or SLEEP).
+        self.wake_interval = 0
+        self.max_wake_interval = 0
+        self.state_changed = False # Set by _enter(), the counters are printed by the next wait()
+
+    def update(self, dx, dy, dz, buttons):
+        # Call once per update with the position deltas (mm) and the buttons
+        now = time.monotonic_ns()
+        previous_tick = self.tick_start
+        self.tick_start = now
+
+        self.moved_x += dx
+        self.moved_y += dy
+        self.moved_z += dz
+        threshold = self.motion_threshold
+        if buttons or buttons != self.last_buttons or abs(self.moved_x) > threshold \
+                or abs(self.moved_y) > threshold or abs(self.moved_z) > threshold:
+            self.last_buttons = buttons
+            self.moved_x = self.moved_y = self.moved_z = 0.0
+            self.last_motion = now
+            if self.state != self.ACTIVE:
+                self.wakeups += 1
+                self.wake_interval = now - previous_tick
+                if self.wake_interval > self.max_wake_interval:
+                    self.max_wake_interval = self.wake_interval
+                self._enter(self.ACTIVE, now)
+        elif self.state != self.SLEEP and now - self.last_motion >= self.timeouts[self.state + 1]:
+            self._enter(self.state + 1, now)
+
+    def wait(self):
+        # Sleep out the rest of the current state's period, call after update()
+        if self.state_changed:
+            self.state_changed = False
+            self.print_counters()
+        period = self.periods[self.state]
+        if period:
+            remaining = self.tick_start + period - time.monotonic_ns()
+            if remaining > 0:
+                time.sleep(remaining / 1000000000)
+
+    def times(self):
+        # Time spent in each state in seconds, including the current stay
+        times = [state_time / 1000000000 for state_time in self.state_time]
+        times[self.state] += (time.monotonic_ns() - self.state_since) / 1000000000
+        return times
+
+    def print_counters(self):
+        # One line with the current state and the counters
+        times = self.times()
+        print("Power: {} (active {:.1f} s, idle {:.1f} s, sleep {:.1f} s, {} wake ups, wake interval {} ms, max {} ms)"
+              .format(self.STATE_NAMES[self.state], times[0], times[1], times[2], self.wakeups,
+                      self.wake_interval // 1000000, self.max_wake_interval // 1000000))
+
+    def _enter(self, state, now):
+        self.state_time[self.state] += now - self.state_since
+        self.state_since = now
+        if self.cpu is not None and (state == self.SLEEP or self.state == self.SLEEP):
+            try:
+                self.cpu.frequency = self.sleep_frequency if state == self.SLEEP else self.normal_frequency
+            except (AttributeError, NotImplementedError, ValueError) as error:
+                print("Power: can't change the CPU frequency,", error)
+                self.cpu = None
+        self.state = state
+        self.state_changed = True
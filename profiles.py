@@ -0,0 +1,52 @@
+# profiles.py
+# A profile bundles the output sinks, filters and sensitivity that CustomHid uses for a mode.
+# They are bound once when the profile is activated (see CustomHid.set_profile) so update() never
+# has to check which profile it is in.
+from acceleration import AccelerationCurve
+from sinks import Sink
+
+class Profile:
+
+    def __init__(self, name, sinks, sensitivity=10, smoothing=3, acceleration=None, plane_coordinates=False):
+        self.name = name
+        self.sinks = sinks # Tuple of sinks.Sink, all fed the same computed sample every update
+        self.sensitivity = sensitivity # Multiplier applied to position deltas (mm) before accumulation
+        self.smoothing = smoothing # The last N rotation captures to average out
+        self.acceleration = acceleration # Optional AccelerationCurve applied to x/y before accumulation
+        self.plane_coordinates = plane_coordinates # Rotate positions into drawing plane coordinates (u, v, distance)
+
+
+# Profile indices, used by the constructor and the host "set profile" command
+MOUSE = 0
+CUSTOM_HID = 1
+PEN = 2
+SCROLL = 3
+MOUSE_AND_CUSTOM_HID = 4
+
+PROFILES = [
+    Profile("mouse", (Sink("output_mouse"),), sensitivity=10, smoothing=3,
+            acceleration=AccelerationCurve(points=((0.0, 0.5), (1.0, 1.0), (4.0, 2.5)), max_speed=8.0),
+            plane_coordinates=True),
+    Profile("custom_hid", (Sink("output_custom_hid"), Sink("output_serial", divider=10, min_change=0.1)),
+            sensitivity=10, smoothing=3),
+    Profile("pen", (Sink("output_pen"),), sensitivity=1, smoothing=3, plane_coordinates=True), # Absolute, so sensitivity only affects move_*
+    Profile("scroll", (Sink("output_scroll"),), sensitivity=1, smoothing=3, plane_coordinates=True), # Gains are set on the ScrollMapper
+    # Drive the OS cursor while a 3D app reads the custom report
+    Profile("mouse_and_custom_hid", (Sink("output_mouse"), Sink("output_custom_hid", divider=2, min_change=0.05)),
+            sensitivity=10, smoothing=3, plane_coordinates=True),
+]
+
+
+def enabled_profiles(names):
+    """
+    Indices of the profiles named in names (comma separated, e.g. the MOBI3_PROFILES setting), in PROFILES order.
+    All of them if names is empty or none of the names are known. Unknown names are skipped with a message,
+    so a typo doesn't keep the pen from starting.
+    """
+    wanted = [name.strip() for name in names.split(",") if name.strip()] if names else []
+    known = [profile.name for profile in PROFILES]
+    for name in wanted:
+        if name not in known:
+            print("Unknown profile in MOBI3_PROFILES:", repr(name))
+    enabled = tuple(index for index, name in enumerate(known) if name in wanted)
+    return enabled if enabled else tuple(range(len(PROFILES)))
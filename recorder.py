@@ -0,0 +1,71 @@
+# recorder.py
+# Captures the raw 12-bit counts of the three AS5600 sensors and the button states into a compact binary log,
+# so real motion can be replayed through CustomHid on a computer (see host/replay.py).
+#
+# Log layout (little-endian):
+#   Header: 4 byte magic b"M3PR", uint8 version, uint8 sensor count
+#   Records: uint32 timestamp in microseconds since recording started (wraps after ~71 minutes),
+#            uint16 raw count per sensor, uint8 button bitmask (CustomHid.read_buttons)
+import struct
+import time
+
+MAGIC = b"M3PR"
+VERSION = 1
+HEADER_FORMAT = "<4sBB"
+RECORD_FORMAT = "<IHHHB"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+SENSOR_COUNT = 3
+
+class Recorder:
+
+    def __init__(self, stream, buffered_records=64):
+        """
+        stream: Anything with write(), e.g. a file opened with "wb" (the CIRCUITPY drive has to be remounted
+                writable in boot.py with storage.remount("/", readonly=False)) or a usb_cdc serial channel.
+        buffered_records: Records are collected in a preallocated buffer and written this many at a time.
+        """
+        self.stream = stream
+        self.buffer = bytearray(RECORD_SIZE * buffered_records)
+        self.position = 0
+        self.record_count = 0
+        self.start_time = time.monotonic_ns()
+        stream.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, SENSOR_COUNT))
+
+    def record(self, raw_counts, buttons):
+        timestamp = ((time.monotonic_ns() - self.start_time) // 1000) & 0xFFFFFFFF
+        struct.pack_into(RECORD_FORMAT, self.buffer, self.position,
+                         timestamp, raw_counts[0], raw_counts[1], raw_counts[2], buttons)
+        self.position += RECORD_SIZE
+        self.record_count += 1
+        if self.position == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if self.position:
+            self.stream.write(memoryview(self.buffer)[:self.position])
+            self.position = 0
+
+    def close(self):
+        self.flush()
+        if hasattr(self.stream, "close"):
+            self.stream.close()
+
+
+def read_records(data):
+    """
+    Yield (timestamp_us, raw_counts, buttons) from a complete log. Timestamps are unwrapped, so they keep
+    increasing past the uint32 limit.
+    """
+    magic, version, sensor_count = struct.unpack_from(HEADER_FORMAT, data, 0)
+    if magic != MAGIC or version != VERSION or sensor_count != SENSOR_COUNT:
+        raise ValueError("Not a Mobi3-Pen recording")
+    offset = struct.calcsize(HEADER_FORMAT)
+    wraps = 0
+    last_timestamp = 0
+    while offset + RECORD_SIZE <= len(data):
+        timestamp, count1, count2, count3, buttons = struct.unpack_from(RECORD_FORMAT, data, offset)
+        if timestamp < last_timestamp:
+            wraps += 1
+        last_timestamp = timestamp
+        yield timestamp + (wraps << 32), (count1, count2, count3), buttons
+        offset += RECORD_SIZE
@@ -0,0 +1,76 @@
+# scroll.py
+# Scroll and zoom from the pen for the scroll profile: moving the pen up and down (or turning the turntable)
+# drives the wheel, moving it sideways pans. With the high resolution mouse the wheel is sent in 1/120 detent
+# steps and the fractions are carried over between updates, so 3D apps get a smooth zoom at the full report
+# rate instead of coarse bursts of whole detents.
+import math
+
+class ScrollMapper:
+
+    # Wheel sources
+    Z = 0 # Height of the pen
+    TURNTABLE = 1 # Rotation of the turntable
+
+    def __init__(self, mouse, source=Z, wheel_gain=0.5, pan_gain=0.2):
+        """
+        mouse: A Mouse or HiResMouse. Horizontal pan and sub-detent steps need the HiResMouse.
+        source: Z or TURNTABLE.
+        wheel_gain: Detents per mm of height (Z) or per degree of turntable rotation (TURNTABLE). Negative flips it.
+        pan_gain: Detents per mm of sideways movement, 0 turns panning off.
+        """
+        self.mouse = mouse
+        self.hires = hasattr(mouse, "poll_multipliers") # A HiResMouse, without importing it for the check
+        self.source = source
+        self.wheel_gain = wheel_gain if source == self.Z else wheel_gain * 180 / math.pi # Per radian
+        self.pan_gain = pan_gain if self.hires else 0
+
+        self.previous_wheel = None
+        self.previous_pan = 0.0
+        # Sub-detent accumulation, in wheel/pan units
+        self.wheel_accumulation = 0.0
+        self.pan_accumulation = 0.0
+
+    def reset(self):
+        # Start from the next update's position, e.g. when the scroll profile is activated
+        self.previous_wheel = None
+        self.wheel_accumulation = 0.0
+        self.pan_accumulation = 0.0
+
+    def update(self, position, rotations):
+        if self.source == self.Z:
+            wheel = position[2]
+        else:
+            wheel = rotations[2]
+        pan = position[0]
+        if self.previous_wheel is None:
+            self.previous_wheel = wheel
+            self.previous_pan = pan
+            return
+
+        delta = wheel - self.previous_wheel
+        if self.source == self.TURNTABLE:
+            # Take the short way round when the rotation wraps at 2 pi
+            if delta > math.pi:
+                delta -= 2 * math.pi
+            elif delta < -math.pi:
+                delta += 2 * math.pi
+        self.previous_wheel = wheel
+
+        if self.hires:
+            self.mouse.poll_multipliers()
+            self.wheel_accumulation += delta * self.wheel_gain * self.mouse.wheel_multiplier
+            self.pan_accumulation += (pan - self.previous_pan) * self.pan_gain * self.mouse.pan_multiplier
+        else:
+            self.wheel_accumulation += delta * self.wheel_gain
+        self.previous_pan = pan
+
+        move_wheel = int(self.wheel_accumulation)
+        move_pan = int(self.pan_accumulation)
+        if not (move_wheel or move_pan):
+            return
+        self.wheel_accumulation -= move_wheel
+        self.pan_accumulation -= move_pan
+        if self.hires:
+            self.mouse.move(0, 0, move_wheel, move_pan)
+        else:
+            self.mouse.move(wheel=move_wheel)
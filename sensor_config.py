@@ -0,0 +1,103 @@
+# sensor_config.py
+# Moves the zero offsets and the smoothing into the AS5600s themselves. The zero position goes into ZPOS and the
+# filters into CONF, so the ANGLE register already reads 0 at the calibrated position and is filtered by the chip,
+# and get_rotations() only has to scale it (see CustomHid.apply_sensor_config).
+#
+# Only the volatile registers are written, nothing is burned into the one-time programmable memory, so the
+# settings are written again at every start and after every bus recovery (see SensorMonitor.configure).
+# The registers are written directly on the bus rather than through adafruit_as5600 so the same code can be
+# checked against the fake register map in host/standins.py (host/check_sensor_config.py).
+
+ADDRESS = 0x36
+
+# Registers, 12-bit values are two bytes, high byte first
+ZMCO = 0x00
+ZPOS = 0x01
+MPOS = 0x03
+MANG = 0x05
+CONF = 0x07
+RAW_ANGLE = 0x0C
+ANGLE = 0x0E
+
+# Same values as the adafruit_as5600 constants
+SLOW_FILTER_16X = 0
+SLOW_FILTER_8X = 1
+SLOW_FILTER_4X = 2
+SLOW_FILTER_2X = 3
+FAST_FILTER_SLOW_ONLY = 0
+FAST_FILTER_6LSB = 1
+FAST_FILTER_7LSB = 2
+FAST_FILTER_9LSB = 3
+FAST_FILTER_18LSB = 4
+FAST_FILTER_21LSB = 5
+FAST_FILTER_24LSB = 6
+FAST_FILTER_10LSB = 7
+HYSTERESIS_OFF = 0
+HYSTERESIS_1LSB = 1
+HYSTERESIS_2LSB = 2
+HYSTERESIS_3LSB = 3
+
+# CONF bits that belong to the analog/PWM output, left as they are
+_OUTPUT_BITS = 0x00F0
+
+class SensorConfig:
+
+    def __init__(self, slow_filter=SLOW_FILTER_16X, fast_filter_threshold=FAST_FILTER_SLOW_ONLY,
+                 hysteresis=HYSTERESIS_OFF, watchdog=False):
+        """
+        slow_filter: Step response of the filter while the magnet is still, 16X is the smoothest and slowest.
+        fast_filter_threshold: Change (in LSB) above which the fast filter takes over, so moving doesn't lag.
+        hysteresis: Output hysteresis, hides the last bit of jitter while still.
+        watchdog: Let the chip drop into low power after a minute without movement.
+        """
+        self.slow_filter = slow_filter
+        self.fast_filter_threshold = fast_filter_threshold
+        self.hysteresis = hysteresis
+        self.watchdog = watchdog
+
+    def conf(self, current=0):
+        # CONF register value, keeping the output stage bits of the current value
+        return (current & _OUTPUT_BITS) | (self.hysteresis << 2) | (self.slow_filter << 8) \
+            | (self.fast_filter_threshold << 10) | (int(self.watchdog) << 13)
+
+# Filter profiles for MOBI3_SENSOR_FILTER in settings.toml
+FILTERS = {
+    "smooth": SensorConfig(SLOW_FILTER_16X, FAST_FILTER_10LSB, HYSTERESIS_1LSB),
+    "balanced": SensorConfig(SLOW_FILTER_8X, FAST_FILTER_6LSB, HYSTERESIS_1LSB),
+    "responsive": SensorConfig(SLOW_FILTER_2X, FAST_FILTER_6LSB, HYSTERESIS_OFF),
+}
+DEFAULT_FILTER = "balanced" # Used for names that aren't in FILTERS
+
+def read_register(bus, register):
+    # Read a 16-bit register
+    buffer = bytearray(2)
+    while not bus.try_lock():
+        pass
+    try:
+        bus.writeto_then_readfrom(ADDRESS, bytes((register,)), buffer)
+    finally:
+        bus.unlock()
+    return (buffer[0] << 8) | buffer[1]
+
+def write_register(bus, register, value):
+    while not bus.try_lock():
+        pass
+    try:
+        bus.writeto(ADDRESS, bytes((register, (value >> 8) & 0xFF, value & 0xFF)))
+    finally:
+        bus.unlock()
+
+def configure(bus, zero_count, config):
+    """
+    Write the zero position (a raw count, 0-4095) and the filter settings, then read them back.
+    MPOS and MANG are cleared so the angle keeps the full 360 degree range.
+    Raises OSError if the bus fails and RuntimeError if the sensor doesn't hold the values.
+    """
+    conf = config.conf(read_register(bus, CONF))
+    expected = ((ZPOS, zero_count & 0xFFF), (MPOS, 0), (MANG, 0), (CONF, conf))
+    for register, value in expected:
+        write_register(bus, register, value)
+    for register, value in expected:
+        actual = read_register(bus, register)
+        if actual != value:
+            raise RuntimeError("AS5600 register 0x{:02X} reads 0x{:04X}, wrote 0x{:04X}".format(register, actual, value))
@@ -0,0 +1,170 @@
+# sensor_health.py
+# Keeps an AS5600 and its I2C bus healthy without stalling the tracking loop.
+# SensorMonitor can be used in place of the AS5600: angle always returns straight away, holding the last
+# good reading while the magnet looks wrong or the bus is being recovered. Recovery (releasing the bus,
+# clocking out a stuck SDA and reconnecting) is split into steps that run one per read, so a failing
+# sensor never holds up the other axes or the USB reports.
+import digitalio
+from adafruit_as5600 import AS5600
+import sensor_config
+
+class SensorMonitor:
+
+    # Status values
+    OK = 0
+    NO_MAGNET = 1
+    MAGNET_TOO_WEAK = 2
+    MAGNET_TOO_STRONG = 3
+    RECOVERING = 4
+    STATUS_NAMES = ("ok", "no magnet", "magnet too weak", "magnet too strong", "recovering")
+
+    # Bus recovery steps
+    _CONNECTED = 0
+    _RELEASE_BUS = 1
+    _CLOCK_OUT = 2
+    _RECONNECT = 3
+
+    def __init__(self, name, make_bus, scl, sda, max_retries=3, health_interval=200, reconnect_delay=100):
+        """
+        name: Used when printing status changes.
+        make_bus: Called with no arguments to (re)create the I2C bus, e.g. lambda: busio.I2C(scl, sda).
+        scl, sda: The bus pins, driven directly to clock out a stuck SDA.
+        max_retries: Consecutive failed reads (each one returns the last good angle) before the bus is recovered.
+        health_interval: Reads between STATUS/AGC checks.
+        reconnect_delay: Reads to wait after a failed reconnect before trying again.
+        """
+        self.name = name
+        self.make_bus = make_bus
+        self.scl = scl
+        self.sda = sda
+        self.max_retries = max_retries
+        self.health_interval = health_interval
+        self.reconnect_delay = reconnect_delay
+
+        self.bus = None
+        self.sensor = None
+        self.status = self.RECOVERING
+        self.agc = 0 # Automatic gain control value from the last health check, mid range is best
+        self.last_angle = 0
+        self.config = None # sensor_config.SensorConfig written at every (re)connect, see configure()
+        self.zero_count = 0
+
+        # Counters
+        self.retries = 0 # Consecutive failed reads
+        self.error_count = 0 # Total failed reads
+        self.recovery_count = 0 # Successful bus recoveries
+
+        self._reads = 0
+        self._wait = 0
+        self._step = self._RECONNECT
+        self._recover()
+
+    def configure(self, zero_count, config):
+        """
+        Have the sensor itself subtract zero_count (a raw count) and filter the angle, see sensor_config.py.
+        The registers are volatile, so they are written again after every bus recovery.
+        """
+        self.zero_count = zero_count
+        self.config = config
+        if self._step != self._CONNECTED:
+            return # Written when the bus reconnects
+        try:
+            sensor_config.configure(self.bus, zero_count, config)
+        except (OSError, RuntimeError) as error:
+            print("Sensor", self.name, ": configuration failed,", error)
+            self._set_status(self.RECOVERING)
+            self._step = self._RELEASE_BUS
+
+    @property
+    def angle(self):
+        if self._step != self._CONNECTED:
+            self._recover()
+            return self.last_angle
+        try:
+            angle = self.sensor.angle
+            self._reads += 1
+            if self._reads >= self.health_interval:
+                self._reads = 0
+                self._check_health()
+        except (OSError, RuntimeError):
+            self._read_failed()
+            return self.last_angle
+
+        self.retries = 0
+        if self.status == self.OK:
+            self.last_angle = angle
+        return self.last_angle
+
+    def _set_status(self, status):
+        if status != self.status:
+            self.status = status
+            print("Sensor", self.name, ":", self.STATUS_NAMES[status], "agc", self.agc)
+
+    def _check_health(self):
+        sensor = self.sensor
+        self.agc = sensor.agc
+        if not sensor.magnet_detected:
+            self._set_status(self.NO_MAGNET)
+        elif sensor.max_gain_overflow:
+            self._set_status(self.MAGNET_TOO_WEAK)
+        elif sensor.min_gain_overflow:
+            self._set_status(self.MAGNET_TOO_STRONG)
+        else:
+            self._set_status(self.OK)
+
+    def _read_failed(self):
+        self.error_count += 1
+        self.retries += 1
+        if self.retries >= self.max_retries:
+            self._set_status(self.RECOVERING)
+            self._step = self._RELEASE_BUS
+
+    def _recover(self):
+        # Run one recovery step
+        step = self._step
+        if step == self._RELEASE_BUS:
+            self.sensor = None
+            if self.bus is not None:
+                self.bus.deinit()
+                self.bus = None
+            self._step = self._CLOCK_OUT
+
+        elif step == self._CLOCK_OUT:
+            # A slave stuck half way through a byte holds SDA low. Clock it out (at most 9 clocks), then send a STOP.
+            scl = digitalio.DigitalInOut(self.scl)
+            sda = digitalio.DigitalInOut(self.sda)
+            sda.switch_to_input(pull=digitalio.Pull.UP)
+            scl.switch_to_output(value=True)
+            for _ in range(9):
+                if sda.value:
+                    break
+                scl.value = False
+                scl.value = True
+            sda.switch_to_output(value=False)
+            scl.value = True
+            sda.value = True
+            scl.deinit()
+            sda.deinit()
+            self._step = self._RECONNECT
+
+        elif step == self._RECONNECT:
+            if self._wait:
+                self._wait -= 1
+                return
+            try:
+                self.bus = self.make_bus()
+                self.sensor = AS5600(self.bus)
+                if self.config is not None:
+                    sensor_config.configure(self.bus, self.zero_count, self.config)
+                self._check_health()
+            except (OSError, RuntimeError, ValueError) as error:
+                print("Sensor", self.name, ": reconnect failed,", error)
+                self.sensor = None
+                self._wait = self.reconnect_delay
+                self._step = self._RELEASE_BUS
+                return
+            self.retries = 0
+            self._reads = 0
+            self._step = self._CONNECTED
+            if self.error_count:
+                self.recovery_count += 1
@@ -0,0 +1,106 @@
+# sinks.py
+# Output sinks let several outputs (mouse, custom HID, digitizer, serial...) subscribe to the one sample
+# CustomHid.update() computes per tick, so adding an output never re-reads the sensors or re-runs the kinematics.
+# Each sink has its own rate divider and change filter. Profiles list their sinks (see profiles.py) and
+# bind_sinks() turns them into the single call update() makes.
+
+class Sink:
+    # The sinks listed in profiles.py only describe an output. bind() makes the working copy for one CustomHid,
+    # which holds the divider's count and the movement added up so far.
+
+    MOVE_LIMIT = 127 # Largest relative move the smallest report (custom HID, 8-bit mouse) holds per axis
+
+    def __init__(self, handler, divider=1, min_change=None):
+        """
+        handler: Name of the CustomHid output method, called as
+                 handler(move_x, move_y, move_z, (x, y, z), (r1, r2, r3), buttons).
+        divider: Only send every Nth tick. Relative movement from the skipped ticks is added up and sent with
+                 the next one, at most MOVE_LIMIT per axis at a time with the rest carried over, so nothing is
+                 lost. A tick is sent straight away when the buttons change or the added up movement reaches
+                 MOVE_LIMIT. With a divider of 1 the moves go to the handler as they are.
+        min_change: If set, skip ticks where there is no relative movement, the buttons are unchanged and the
+                    position moved less than this (mm) on every axis since the last one sent.
+        """
+        self.handler_name = handler
+        self.divider = divider
+        self.min_change = min_change
+        self.handler = None
+
+        self.count = 0
+        self.move_x = 0
+        self.move_y = 0
+        self.move_z = 0
+        self.last_x = 0.0
+        self.last_y = 0.0
+        self.last_z = 0.0
+        self.last_buttons = -1
+
+    def bind(self, device):
+        # Returns a new Sink like this one sending to device's handler, starting from scratch
+        sink = Sink(self.handler_name, self.divider, self.min_change)
+        sink.handler = getattr(device, self.handler_name)
+        return sink
+
+    def send(self, move_x, move_y, move_z, position, rotations, buttons):
+        move_x += self.move_x
+        move_y += self.move_y
+        move_z += self.move_z
+        self.count += 1
+        limit = self.MOVE_LIMIT
+        if self.count < self.divider and buttons == self.last_buttons \
+                and -limit < move_x < limit and -limit < move_y < limit and -limit < move_z < limit:
+            self.move_x = move_x
+            self.move_y = move_y
+            self.move_z = move_z
+            return
+        self.count = 0
+
+        x, y, z = position
+        min_change = self.min_change
+        if min_change is not None and buttons == self.last_buttons and not (move_x or move_y or move_z) \
+                and abs(x - self.last_x) < min_change and abs(y - self.last_y) < min_change \
+                and abs(z - self.last_z) < min_change:
+            self.move_x = self.move_y = self.move_z = 0
+            return
+        self.last_x = x
+        self.last_y = y
+        self.last_z = z
+        self.last_buttons = buttons
+
+        if self.divider == 1:
+            # Nothing added up, so the same as being bound straight to the handler (see bind_sinks)
+            self.handler(move_x, move_y, move_z, position, rotations, buttons)
+            return
+        # Send what fits in a report and carry the rest
+        send_x = max(-limit, min(limit, move_x))
+        send_y = max(-limit, min(limit, move_y))
+        send_z = max(-limit, min(limit, move_z))
+        self.move_x = move_x - send_x
+        self.move_y = move_y - send_y
+        self.move_z = move_z - send_z
+        self.handler(send_x, send_y, send_z, position, rotations, buttons)
+
+
+class SinkGroup:
+    # Fans one sample out to several sinks
+
+    def __init__(self, sinks):
+        self.sinks = tuple(sink.send for sink in sinks)
+
+    def send(self, move_x, move_y, move_z, position, rotations, buttons):
+        for send in self.sinks:
+            send(move_x, move_y, move_z, position, rotations, buttons)
+
+
+def bind_sinks(device, sinks):
+    """
+    Bind sinks to a CustomHid and return the one function update() should call per tick. A single sink with
+    no divider or change filter is bound straight to its handler, so it costs nothing extra.
+    """
+    sinks = [sink.bind(device) for sink in sinks]
+    if len(sinks) == 1:
+        sink = sinks[0]
+        if sink.divider == 1 and sink.min_change is None:
+            return sink.handler
+        return sink.send
+    return SinkGroup(sinks).send
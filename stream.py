@@ -0,0 +1,105 @@
+# stream.py
+# Binary sample stream over the usb_cdc data channel enabled in boot.py. It carries every sample at the full
+# update rate, next to the HID reports and without touching the REPL console.
+#
+# Each sample is one COBS encoded frame ending in a 0x00 byte, so a reader can always find the start of the
+# next frame. Decoded, a frame is (little-endian):
+#   uint16  sequence number, to spot dropped frames
+#   uint32  timestamp in microseconds (wraps)
+#   float32 x, y, z of the pen tip in mm, in the arm's coordinates (before any drawing plane transform)
+#   uint16  raw sensor counts (arm1, arm2, turntable)
+#   uint8   buttons (CustomHid.read_buttons)
+#   uint8   active profile
+#   uint16  CRC-16/CCITT-FALSE of everything before it
+# host/stream_reader.py reads it on the computer.
+import struct
+import time
+from array import array
+
+SAMPLE_FORMAT = "<HIfffHHHBB"
+SAMPLE_SIZE = struct.calcsize(SAMPLE_FORMAT)
+FRAME_SIZE = SAMPLE_SIZE + 2 # With the CRC
+MAX_ENCODED_SIZE = FRAME_SIZE + FRAME_SIZE // 254 + 2 # COBS overhead and the 0x00 delimiter
+
+# CRC-16/CCITT-FALSE lookup table, built once
+CRC_TABLE = array("H", [0] * 256)
+for _i in range(256):
+    _crc = _i << 8
+    for _ in range(8):
+        _crc = ((_crc << 1) ^ 0x1021) if _crc & 0x8000 else (_crc << 1)
+    CRC_TABLE[_i] = _crc & 0xFFFF
+
+
+def crc16(data, length):
+    crc = 0xFFFF
+    table = CRC_TABLE
+    for i in range(length):
+        crc = ((crc << 8) & 0xFFFF) ^ table[((crc >> 8) ^ data[i]) & 0xFF]
+    return crc
+
+
+def cobs_encode(source, length, destination):
+    # Encode source[:length] into destination, add the 0x00 delimiter and return the encoded length
+    code_index = 0
+    code = 1
+    out = 1
+    for i in range(length):
+        byte = source[i]
+        if byte:
+            destination[out] = byte
+            out += 1
+            code += 1
+        if not byte or code == 0xFF:
+            destination[code_index] = code
+            code_index = out
+            out += 1
+            code = 1
+    destination[code_index] = code
+    destination[out] = 0
+    return out + 1
+
+
+def cobs_decode(frame):
+    # Decode one frame (without its 0x00 delimiter). Returns a bytearray, raises ValueError if it is malformed.
+    decoded = bytearray()
+    i = 0
+    length = len(frame)
+    while i < length:
+        code = frame[i]
+        if code == 0 or i + code > length + 1:
+            raise ValueError("Bad COBS frame")
+        decoded += frame[i + 1:i + code]
+        i += code
+        if code < 0xFF and i < length:
+            decoded.append(0)
+    return decoded
+
+
+class SampleStream:
+
+    def __init__(self, serial):
+        """
+        serial: usb_cdc.data. Frames are dropped rather than waiting while nothing on the host reads the channel.
+        """
+        self.serial = serial
+        serial.write_timeout = 0
+        self.frame = bytearray(FRAME_SIZE)
+        self.encoded = bytearray(MAX_ENCODED_SIZE)
+        self.sequence = 0
+        self.dropped = 0 # Frames not written because the host wasn't reading
+
+    def send(self, position, raw_counts, buttons, profile):
+        if not self.serial.connected:
+            return
+        frame = self.frame
+        struct.pack_into(SAMPLE_FORMAT, frame, 0,
+                         self.sequence, (time.monotonic_ns() // 1000) & 0xFFFFFFFF,
+                         position[0], position[1], position[2],
+                         raw_counts[0], raw_counts[1], raw_counts[2],
+                         buttons, profile)
+        struct.pack_into("<H", frame, SAMPLE_SIZE, crc16(frame, SAMPLE_SIZE))
+        length = cobs_encode(frame, FRAME_SIZE, self.encoded)
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        written = self.serial.write(memoryview(self.encoded)[:length])
+        if written != length:
+            self.dropped += 1